@@ -0,0 +1 @@
+from bench.harness import BENCHES, register, load_benches, measure, summarize, select, run, save, load, series
@@ -0,0 +1,25 @@
+import sys
+import argparse
+from bench import select, run, save
+from bench.harness import format_result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Run the BM_BLS/BM_SB microbenchmarks')
+    parser.add_argument('benches', nargs='*', help='bench name prefixes, e.g. g1 bm_sb.verify (default: all)')
+    parser.add_argument('-o', '--out', default='time.json')
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--signers-max-power', type=int, default=6, help='sweep 2^0 .. 2^k issuers')
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args(argv)
+
+    names = select(args.benches)
+    if args.list:
+        print('\n'.join(names))
+        return
+    signers = [2**i for i in range(args.signers_max_power + 1)]
+    results = run(names, signers, args.runs, args.warmup, log=lambda r: print(format_result(r), file=sys.stderr))
+    save(args.out, results, runs=args.runs, warmup=args.warmup, signers=signers)
+
+if __name__ == '__main__':
+    main()
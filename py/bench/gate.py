@@ -0,0 +1,143 @@
+import sys
+import math
+import argparse
+from bench import select, run, save, load
+from bench.harness import format_result
+
+# Regression gate: reruns the bench matrix (or takes stored results) and compares every
+# (bench, issuers) cell against a baseline file with a one-sided Mann-Whitney U test on the raw
+# samples. A cell regresses if it is significantly slower and its median moved by more than the
+# threshold, so noise on fast primitives alone doesn't fail the gate.
+ALPHA = 0.01
+THRESHOLD = 0.05
+
+def _ranks(values):
+    # ranks starting at 1, ties get their average rank; also returns sum(t^3 - t) over tie groups
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    ties = 0
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    return (ranks, ties)
+
+def mann_whitney_u(xs, ys):
+    # (U of xs, p-value of xs being stochastically greater than ys), normal approximation with
+    # tie and continuity correction; fine from ~8 samples per side
+    (n1, n2) = (len(xs), len(ys))
+    n = n1 + n2
+    (ranks, ties) = _ranks(list(xs) + list(ys))
+    u = sum(ranks[:n1]) - n1 * (n1 + 1) / 2
+    mu = n1 * n2 / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return (u, 1.0)
+    z = (u - mu - 0.5) / sigma
+    return (u, 0.5 * math.erfc(z / math.sqrt(2)))
+
+def compare(baseline, current, alpha=ALPHA, threshold=THRESHOLD):
+    # one row per cell of current: verdict is 'slower', 'faster', 'ok' or 'new'
+    base = {(r['name'], r['signers']): r for r in baseline}
+    rows = []
+    for r in current:
+        b = base.get((r['name'], r['signers']))
+        row = {'name': r['name'], 'signers': r['signers'], 'p50': r['stats']['p50']}
+        if b is None:
+            rows.append({**row, 'verdict': 'new'})
+            continue
+        ratio = r['stats']['p50'] / b['stats']['p50']
+        (_, p_slower) = mann_whitney_u(r['samples'], b['samples'])
+        (_, p_faster) = mann_whitney_u(b['samples'], r['samples'])
+        if p_slower < alpha and ratio > 1 + threshold:
+            verdict = 'slower'
+        elif p_faster < alpha and ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            verdict = 'ok'
+        rows.append({**row, 'base_p50': b['stats']['p50'], 'ratio': ratio, 'p': min(p_slower, p_faster), 'verdict': verdict})
+    return rows
+
+def format_row(row):
+    signers = '' if row['signers'] is None else f"[{row['signers']}]"
+    name = f"{row['name'] + signers:<28}"
+    if row['verdict'] == 'new':
+        return f"{name} {'':>12} -> {row['p50'] / 1e6:10.3f} ms  new"
+    return f"{name} {row['base_p50'] / 1e6:10.3f} ms -> {row['p50'] / 1e6:10.3f} ms  {100 * (row['ratio'] - 1):+7.1f}%  p={row['p']:.2g}  {row['verdict']}"
+
+def report(rows, out=sys.stdout):
+    # per-operation breakdown: primitives first, then the protocol sweeps
+    for row in sorted(rows, key=lambda row: (row['signers'] is not None, row['name'], row['signers'] or 0)):
+        print(format_row(row), file=out)
+    slower = [row for row in rows if row['verdict'] == 'slower']
+    print(f'{len(slower)} significant slowdown(s) out of {len(rows)}', file=out)
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.gate', description='Compare benchmark results against a baseline')
+    parser.add_argument('benches', nargs='*', help='bench name prefixes (default: all in the baseline)')
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--results', help='compare these stored results instead of running the benches')
+    parser.add_argument('--out', help='also store the results of this run')
+    parser.add_argument('--update', action='store_true', help='run the benches and overwrite the baseline')
+    parser.add_argument('--alpha', type=float, default=ALPHA)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='minimum relative change of the median')
+    parser.add_argument('--runs', type=int)
+    parser.add_argument('--warmup', type=int)
+    parser.add_argument('--signers-max-power', type=int)
+    args = parser.parse_args(argv)
+
+    baseline = None if args.update else load(args.baseline)
+    if args.results is not None:
+        current = load(args.results)['results']
+    else:
+        # same configuration as the baseline unless overridden, so samples are comparable
+        meta = baseline['meta'] if baseline is not None else {}
+        runs = args.runs or meta.get('runs', 30)
+        warmup = args.warmup if args.warmup is not None else meta.get('warmup', 3)
+        if args.signers_max_power is not None:
+            signers = [2**i for i in range(args.signers_max_power + 1)]
+        else:
+            signers = meta.get('signers', [2**i for i in range(7)])
+        names = select(args.benches)
+        if baseline is not None and not args.benches:
+            names = [name for name in names if any(r['name'] == name for r in baseline['results'])]
+        current = run(names, signers, runs, warmup, log=lambda r: print(format_result(r), file=sys.stderr))
+        for path in filter(None, [args.out, args.baseline if args.update else None]):
+            save(path, current, runs=runs, warmup=warmup, signers=signers)
+
+    if baseline is None:
+        return 0
+    slower = report(compare(baseline['results'], current, args.alpha, args.threshold))
+    return 1 if slower else 0
+
+import unittest
+import random
+from bench.harness import summarize
+
+class TestGate(unittest.TestCase):
+    def test_mann_whitney_u(self):
+        (u, p) = mann_whitney_u(range(6, 11), range(1, 6))
+        self.assertEqual(u, 25)
+        self.assertAlmostEqual(p, 0.0061, places=4)
+        self.assertGreater(mann_whitney_u(range(1, 6), range(6, 11))[1], 0.99)
+        self.assertEqual(mann_whitney_u([1, 1, 1], [1, 1, 1]), (4.5, 1.0))
+
+    def test_compare(self):
+        rng = random.Random(0)
+        def result(name, scale):
+            samples = [scale * rng.gauss(1000, 10) for _ in range(30)]
+            return {'name': name, 'signers': 1, 'samples': samples, 'stats': summarize(samples)}
+        baseline = [result('a', 1), result('b', 1), result('c', 1)]
+        current = [result('a', 1.5), result('b', 1.01), result('c', 0.5), result('d', 1)]
+        verdicts = {row['name']: row['verdict'] for row in compare(baseline, current)}
+        self.assertEqual(verdicts, {'a': 'slower', 'b': 'ok', 'c': 'faster', 'd': 'new'})
+
+if __name__ == '__main__':
+    sys.exit(main())
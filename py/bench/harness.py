@@ -0,0 +1,155 @@
+import gc
+import json
+import importlib
+import time
+import platform
+import statistics
+
+# A bench is a factory registered under a name: given the number of issuers (None unless the bench
+# sweeps them) it returns (setup, fn) or (setup, fn, teardown). setup() runs outside the timed
+# region before every sample and its result is passed to fn, teardown() once after the last one;
+# a sample is the time of `number` calls of fn, divided by number * per (per e.g. the messages in
+# a batch). Results keep the raw samples in ns so runs can be compared later.
+BENCHES = {}
+
+# the registering modules need the native extension, so they are only imported once benches are
+# selected or run and e.g. plotting stored results with load/series works without it
+BENCH_MODULES = ('bench.primitives', 'bench.protocols')
+
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+def register(name, sweep=False, per=1, number=1):
+    def decorator(factory):
+        BENCHES[name] = (factory, sweep, per, number)
+        return factory
+    return decorator
+
+def measure(fn, setup=None, runs=30, warmup=3, per=1, number=1):
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable() # as in timeit, collections would land in random samples
+    try:
+        for i in range(warmup + runs):
+            args = setup() if setup is not None else ()
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                fn(*args)
+            elapsed = time.perf_counter_ns() - start
+            if i >= warmup:
+                samples.append(elapsed / (number * per))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return samples
+
+def percentile(sorted_samples, p):
+    # linear interpolation between closest ranks
+    k = (len(sorted_samples) - 1) * p / 100
+    i = int(k)
+    if i + 1 == len(sorted_samples):
+        return sorted_samples[i]
+    return sorted_samples[i] + (sorted_samples[i + 1] - sorted_samples[i]) * (k - i)
+
+def summarize(samples):
+    s = sorted(samples)
+    stats = {
+        'n': len(s),
+        'mean': statistics.fmean(s),
+        'stdev': statistics.stdev(s) if len(s) > 1 else 0.0,
+        'min': s[0],
+        'max': s[-1],
+    }
+    for p in PERCENTILES:
+        stats[f'p{p}'] = percentile(s, p)
+    return stats
+
+def load_benches():
+    for module in BENCH_MODULES:
+        importlib.import_module(module)
+
+def select(patterns=None):
+    # bench names matching any of the prefixes, all of them by default
+    load_benches()
+    if not patterns:
+        return list(BENCHES)
+    return [name for name in BENCHES if any(name.startswith(pattern) for pattern in patterns)]
+
+def run(names=None, signers=(1,), runs=30, warmup=3, log=None):
+    results = []
+    if names is None:
+        load_benches()
+    for name in names or BENCHES:
+        (factory, sweep, per, number) = BENCHES[name]
+        for num_signers in (signers if sweep else [None]):
+            (setup, fn, *teardown) = factory(num_signers)
+            try:
+                samples = measure(fn, setup, runs, warmup, per, number)
+            finally:
+                for f in teardown:
+                    f()
+            result = {'name': name, 'signers': num_signers, 'samples': samples, 'stats': summarize(samples)}
+            results.append(result)
+            if log is not None:
+                log(result)
+    return results
+
+def metadata(**config):
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'unit': 'ns',
+        **config,
+    }
+
+def save(path, results, **config):
+    with open(path, 'w') as f:
+        json.dump({'meta': metadata(**config), 'results': results}, f, indent=1)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def series(results, name):
+    # (signers, stats) of one bench ordered by issuer count, for plotting
+    points = sorted((r['signers'], r['stats']) for r in results if r['name'] == name)
+    return ([n for (n, _) in points], [stats for (_, stats) in points])
+
+def format_result(result):
+    stats = result['stats']
+    signers = '' if result['signers'] is None else f"[{result['signers']}]"
+    return f"{result['name'] + signers:<28} p50 {stats['p50'] / 1e6:10.3f} ms  p90 {stats['p90'] / 1e6:10.3f} ms  n={stats['n']}"
+
+import sys
+import unittest
+import subprocess
+
+class TestHarness(unittest.TestCase):
+    def test_summarize(self):
+        stats = summarize([float(x) for x in range(1, 101)])
+        self.assertEqual(stats['n'], 100)
+        self.assertEqual(stats['min'], 1)
+        self.assertEqual(stats['max'], 100)
+        self.assertAlmostEqual(stats['p50'], 50.5)
+        self.assertAlmostEqual(stats['p90'], 90.1)
+        self.assertEqual(summarize([3.0])['p99'], 3.0)
+
+    def test_run(self):
+        calls = []
+        teardowns = []
+        register('test.noop', sweep=True, per=2, number=3)(lambda n: (lambda: (n,), calls.append, lambda: teardowns.append(n)))
+        try:
+            results = run(['test.noop'], signers=[1, 4], runs=5, warmup=2)
+        finally:
+            del BENCHES['test.noop']
+        self.assertEqual(len(calls), 2 * (5 + 2) * 3)
+        self.assertEqual(teardowns, [1, 4])
+        self.assertEqual([(r['name'], r['signers'], r['stats']['n']) for r in results], [('test.noop', 1, 5), ('test.noop', 4, 5)])
+        self.assertEqual(series(results, 'test.noop')[0], [1, 4])
+
+    def test_lazy_registration(self):
+        code = 'import sys, bench.harness; assert "py_eth_pairing" not in sys.modules'
+        subprocess.run([sys.executable, '-c', code], check=True)
@@ -0,0 +1,70 @@
+import os
+from ec import from_ecc_py
+import py_eth_pairing
+from hash_to_point import hash_to_point
+from utils import serialize
+from py_ecc.bn128 import neg
+from bench.harness import register
+BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+
+# Single curve, pairing, hashing and serialization operations on the native backend. Fast
+# operations are repeated `number` times per sample to stay well above the timer resolution.
+DOMAIN = b'BENCH'
+
+def rand_g1():
+    return BN128Point.G1() * BN128FQ.rand()
+
+def rand_g2():
+    return BN128Point.G2() * BN128FQ.rand()
+
+@register('g1.add', number=100)
+def g1_add(_):
+    return (lambda: (rand_g1(), rand_g1()), lambda p, q: p + q)
+
+@register('g1.mul', number=10)
+def g1_mul(_):
+    # variable base
+    return (lambda: (rand_g1(), BN128FQ.rand()), lambda p, k: p * k)
+
+@register('g1.mul_fixed', number=10)
+def g1_mul_fixed(_):
+    g = BN128Point.G1()
+    return (lambda: (BN128FQ.rand(),), lambda k: g * k)
+
+# G2 points only go through msm_g2 and the fixed-base table, so variable-base operations time the
+# backend directly
+@register('g2.add', number=10)
+def g2_add(_):
+    return (lambda: (rand_g2().p, rand_g2().p), py_eth_pairing.add_g2)
+
+@register('g2.mul')
+def g2_mul(_):
+    return (lambda: (rand_g2().p, BN128FQ.rand().n), py_eth_pairing.multiply_g2)
+
+@register('g2.mul_fixed')
+def g2_mul_fixed(_):
+    g = BN128Point.G2()
+    return (lambda: (BN128FQ.rand(),), lambda k: g * k)
+
+@register('pairing')
+def pairing(_):
+    # the two-pair product check of a BM_BLS verification
+    neg_g2 = BN128Point(neg(BN128Point.G2().p))
+    def setup():
+        k = BN128FQ.rand()
+        return (BN128Point.G1() * k, BN128Point.G2() * k)
+    return (setup, lambda sigma, pk: BN128Point.pairing(sigma, neg_g2, BN128Point.G1(), pk))
+
+@register('hash_to_point', number=10)
+def hash_to_point_(_):
+    # fresh messages, so the LRU cache never hits
+    return (lambda: (os.urandom(32),), lambda msg: hash_to_point(msg, DOMAIN))
+
+@register('serialize.token', number=100)
+def serialize_token(_):
+    # a BM_SB token (m, R_bar, y_bar, z_bar)
+    return (lambda: (BN128FQ.rand(), rand_g1(), BN128FQ.rand(), BN128FQ.rand()), lambda *token: serialize(token))
+
+@register('serialize.g2', number=100)
+def serialize_g2(_):
+    return (lambda: (rand_g2(),), lambda p: serialize(p))
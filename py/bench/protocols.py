@@ -0,0 +1,65 @@
+from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+from ec import from_ecc_py
+import py_eth_pairing
+from bm_bls import BM_BLS
+from bm_sb import BM_SB
+from bench.harness import register
+BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+
+# End-to-end issuance and verification, swept over the number of issuers. Keys are fixed per
+# issuer count, so verification runs against a warm committee cache as a long-lived verifier would.
+AGGR_MESSAGES = 32
+
+def bm_bls(num_signers):
+    bm = BM_BLS(BN128Point, BN128FQ, num_signers)
+    (pks, sks) = bm.keygen()
+    return (bm, sks, pks)
+
+def bm_sb(num_signers, executor=None):
+    bm = BM_SB(BN128Point, BN128FQ, 32, lambda x: sha256(x).digest(), num_signers, executor, hash_ctor=sha256)
+    (sks, pks) = bm.keygen()
+    return (bm, sks, pks)
+
+@register('bm_bls.sign', sweep=True)
+def bm_bls_sign(num_signers):
+    (bm, sks, pks) = bm_bls(num_signers)
+    return (lambda: (BN128FQ.rand(),), lambda m: bm.sign(sks, pks, m))
+
+@register('bm_bls.verify', sweep=True)
+def bm_bls_verify(num_signers):
+    (bm, sks, pks) = bm_bls(num_signers)
+    def setup():
+        m = BN128FQ.rand()
+        return (m, bm.sign(sks, pks, m))
+    return (setup, lambda m, sigma: bm.verify(pks, m, sigma))
+
+@register('bm_bls.verify_aggr', sweep=True, per=AGGR_MESSAGES)
+def bm_bls_verify_aggr(num_signers):
+    # reported per message
+    (bm, sks, pks) = bm_bls(num_signers)
+    def setup():
+        ms = [BN128FQ.rand() for _ in range(AGGR_MESSAGES)]
+        return (ms, bm.sign_many(sks, pks, ms))
+    return (setup, lambda ms, sigmas: bm.verify_aggr(pks, ms, sigmas))
+
+@register('bm_sb.sign', sweep=True)
+def bm_sb_sign(num_signers):
+    (bm, sks, pks) = bm_sb(num_signers)
+    return (lambda: (BN128FQ.rand(),), lambda m: bm.sign(pks, sks, m))
+
+@register('bm_sb.sign.threads', sweep=True)
+def bm_sb_sign_threads(num_signers):
+    # the signers' steps of each round on one thread per signer, against bm_sb.sign; the pool is
+    # shut down after the cell so idle threads don't pile up over the sweep
+    executor = ThreadPoolExecutor(num_signers)
+    (bm, sks, pks) = bm_sb(num_signers, executor)
+    return (lambda: (BN128FQ.rand(),), lambda m: bm.sign(pks, sks, m), executor.shutdown)
+
+@register('bm_sb.verify', sweep=True)
+def bm_sb_verify(num_signers):
+    (bm, sks, pks) = bm_sb(num_signers)
+    def setup():
+        m = BN128FQ.rand()
+        return (m, bm.sign(pks, sks, m))
+    return (setup, lambda m, sigma: bm.verify(pks, m, sigma))
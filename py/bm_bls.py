@@ -1,26 +1,31 @@
 from hashlib import sha256
-from functools import reduce
 from ec import ECPoint, FQ
-from hash_to_point import hash_to_point
-from utils import serialize, multi_controller, timing_decorator, byte_count_decorator
+from hash_to_point import hash_to_point, hash_to_point_many
+from utils import serialize, encoded_size, ByteCounter, multi_controller, async_multi_controller, LoopbackEndpoint, wall_time_decorator, byte_count_decorator, LRUCache, Transcript
 
 from py_ecc.bn128 import neg, add, multiply, FQ12 # TODO: remove
 
 class BM_BLS:
-    def __init__(self, ec_point: ECPoint, fq: FQ, num_signers):
+    def __init__(self, ec_point: ECPoint, fq: FQ, num_signers, committee_cache_size=128, executor=None):
         self.ec_point = ec_point
         self.fq = fq
         self.g1 = ec_point.G1()
         self.g2 = ec_point.G2()
-        self.neg_g2 = ec_point(neg(ec_point.G2().p))
+        self.neg_g2 = ec_point(neg(self.g2.p))
 
         self.num_signers = num_signers # TODO: inconsistent naming across implementations
         self.hash = lambda x: sha256(x).digest()
+        self.hash_ctor = sha256
         self.domain = self.hash(b"DOMAIN_BM_BLS")
+        self.committee_cache = LRUCache(committee_cache_size)
+        self.executor = executor # e.g. a ThreadPoolExecutor to run each round's signer steps concurrently
 
     def H(self, *args):
         return self.ec_point(hash_to_point(serialize(args), self.domain))
 
+    def H_many(self, ms):
+        return [self.ec_point(p) for p in hash_to_point_many([serialize((m,)) for m in ms], self.domain)]
+
     def _H(self, *args):
         return int.from_bytes(
             self.hash(serialize(args)),
@@ -36,28 +41,39 @@ class BM_BLS:
         for _ in range(self.num_signers):
             sk = self.fq.rand()
             sks.append(sk)
-            pk = (self.g1 * sk, self.ec_point(multiply(self.g2.p, sk.n)))
+            pk = (self.g1 * sk, self.g2 * sk)
             pks.append(pk)
 
         return (pks, sks) # TODO: inconsistent order (sks, pks) / (pks, sks)
 
     def _a(self, pks):
+        return self._committee(pks)[0]
+
+    def keyaggr(self, pks):
+        return self._committee(pks)[1]
+
+    def _committee(self, pks):
+        # (a_i, apk) only depend on the committee, so cache them by a digest of its G2 keys
+        key = self.hash(serialize([pk[1] for pk in pks]))
+        committee = self.committee_cache.get(key)
+        if committee is None:
+            a = self._compute_a(pks)
+            apk = self._compute_keyaggr(pks, a)
+            committee = (a, apk)
+            self.committee_cache.put(key, committee)
+        return committee
+
+    def _compute_a(self, pks):
+        # H_agg(all_pks, pk_i) for every signer with ('agg', all_pks) absorbed once
+        t = Transcript(self.hash_ctor, 'agg', list(map(lambda pk: pk[1], pks)))
         a = [
-            self.H_agg(
-                list(map(lambda pk: pk[1], pks)),
-                pks[signer_index][1]
-            )
+            self.fq(int.from_bytes(t.digest(pks[signer_index][1]), 'big'))
             for signer_index in range(self.num_signers)
         ]
         return a
 
-    def keyaggr(self, pks):
-        a = self._a(pks)
-        apk = self.ec_point(reduce(add, [
-            multiply(pks[signer_index][1].p, a[signer_index].n)
-            for signer_index in range(self.num_signers)
-        ]))
-        return apk
+    def _compute_keyaggr(self, pks, a):
+        return self.ec_point.msm_g2([pk[1] for pk in pks], a)
 
     #@byte_count_decorator
     def S(self, sk):
@@ -65,29 +81,92 @@ class BM_BLS:
         s_bar = m * sk
         yield s_bar
 
-    def U(self, m, pks, S):
-        sigma_bars = []
-        for i, s in enumerate(S):
-            r = self.fq.rand()
-            m_bar = self.H(m) + self.g1 * r
-            s_bar = s.send(m_bar)
-            sigma_bar = s_bar + self.ec_point.neg(pks[i][0] * r)
-            sigma_bars.append(sigma_bar)
+    def U(self, m, pks):
+        h = self.H(m)
+        rs = [self.fq.rand() for _ in range(self.num_signers)]
+        m_bars = [h + self.g1 * r for r in rs]
+        s_bars = yield m_bars
+        sigma_bars = [s_bars[i] + self.ec_point.neg(pks[i][0] * rs[i]) for i in range(self.num_signers)]
 
         a = self._a(pks)
-        sigma = self.ec_point.sum([sigma_bars[s] * a[s] for s in range(self.num_signers)])
-        yield sigma
+        sigma = self.ec_point.msm(sigma_bars, a)
+        return sigma
+
+    def S_many(self, sk):
+        m_bars = yield
+        s_bars = self.ec_point.mul_many(m_bars, [sk] * len(m_bars))
+        yield s_bars
+
+    def U_many(self, ms, pks):
+        # one round for all messages: issuer i gets [m_bar_i1, ..., m_bar_iK] and returns them signed
+        hs = self.H_many(ms)
+        rs = [[self.fq.rand() for _ in ms] for _ in range(self.num_signers)]
+        m_bars = [[h + self.g1 * r for (h, r) in zip(hs, rs_i)] for rs_i in rs]
+        s_bars = yield m_bars
+
+        # sigma_j = sum_i a_i * (s_bar_ij - r_ij * pk_i), as one msm over the s_bar_ij and pk_i
+        a = self._a(pks)
+        zero = self.fq(0)
+        pks_g1 = [pk[0] for pk in pks]
+        sigmas = []
+        for j in range(len(ms)):
+            r_j = [rs_i[j] for rs_i in rs]
+            sigma = self.ec_point.msm(
+                [s_bars_i[j] for s_bars_i in s_bars] + pks_g1,
+                a + [zero - a_r for a_r in self.fq.vmul(a, r_j)]
+            )
+            sigmas.append(sigma)
+        return sigmas
 
     def verify(self, pks, m, sigma):
         apk = self.keyaggr(pks)
         return self.ec_point.pairing(sigma, self.neg_g2, self.H(m), apk)
 
+    def redeem(self, pks, m, sigma, ledger):
+        # verifies the token and records it in a RedemptionLedger, False if invalid or already spent
+        return self.verify(pks, m, sigma) and ledger.spend(m)
+
+    def verify_batch(self, pks, items):
+        # returns the indices of the (m, sigma) pairs that fail verification
+        apk = self.keyaggr(pks)
+        hs = self.H_many([m for (m, _) in items])
+        sigmas = [sigma for (_, sigma) in items]
+        return self._bisect(apk, hs, sigmas, list(range(len(items))))
+
+    def _bisect(self, apk, hs, sigmas, indices):
+        if not indices or self._verify_combined(apk, hs, sigmas, indices):
+            return []
+        if len(indices) == 1:
+            return indices
+
+        mid = len(indices) // 2
+        return self._bisect(apk, hs, sigmas, indices[:mid]) + self._bisect(apk, hs, sigmas, indices[mid:])
+
+    def _verify_combined(self, apk, hs, sigmas, indices):
+        if len(indices) == 1:
+            i = indices[0]
+            return self.ec_point.pairing(sigmas[i], self.neg_g2, hs[i], apk)
+
+        # random linear combination: e(sum r_i*sigma_i, -g2) * e(sum r_i*H(m_i), apk) == 1
+        rs = [self.fq.rand() for _ in indices]
+        sigma = self.ec_point.msm([sigmas[i] for i in indices], rs)
+        h = self.ec_point.msm([hs[i] for i in indices], rs)
+        return self.ec_point.pairing(sigma, self.neg_g2, h, apk)
+
     def verify_aggr(self, pks, ms, sigmas):
         apk = self.keyaggr(pks)
         sigma = self.ec_point.sum(sigmas)
-        hs = self.ec_point.sum([self.H(m) for m in ms])
+        hs = self.ec_point.sum(self.H_many(ms))
         return self.ec_point.pairing(sigma, self.neg_g2, hs, apk)
 
+    def verify_aggr_multi(self, batches):
+        # batches = [(pks, ms, sigmas), ...] over distinct committees, checked in one multi-pairing
+        sigma = self.ec_point.sum([sigma for (_, _, sigmas) in batches for sigma in sigmas])
+        ps = [sigma, self.neg_g2]
+        for (pks, ms, _) in batches:
+            ps += [self.ec_point.sum(self.H_many(ms)), self.keyaggr(pks)]
+        return self.ec_point.pairing(*ps)
+
     def verify_aggr_hm(self, pks, hms, sigmas):
         apk = self.keyaggr(pks)
         sigma = self.ec_point.sum(sigmas)
@@ -96,16 +175,38 @@ class BM_BLS:
 
     def sign(self, sks, pks, m):
         return multi_controller(
-            lambda *args: self.U(m, pks, *args),
-            [(lambda sk: lambda *args: self.S(sk, *args))(sks[i]) for i in range(self.num_signers)]
+            lambda: self.U(m, pks),
+            [(lambda sk: lambda *args: self.S(sk, *args))(sks[i]) for i in range(self.num_signers)],
+            self.executor
         )
 
+    def sign_many(self, sks, pks, ms):
+        return multi_controller(
+            lambda: self.U_many(ms, pks),
+            [(lambda sk: lambda *args: self.S_many(sk, *args))(sks[i]) for i in range(self.num_signers)],
+            self.executor
+        )
+
+    async def sign_async(self, pks, m, endpoints, timeout=None):
+        # endpoints[i] is an async transport to the i-th signer running S
+        return await async_multi_controller(lambda: self.U(m, pks), endpoints, timeout)
+
+    def loopback_endpoints(self, sks, delay=0, codec=None):
+        return [LoopbackEndpoint((lambda sk: lambda: self.S(sk))(sk), delay, codec) for sk in sks]
+
 import unittest
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from ec import from_ecc_py
+from hash_to_point import _hash_to_point
+import hash_to_point as hash_to_point_module
+from ledger import RedemptionLedger
 # from py_ecc import bn128
 # BN128FQ, BN128Point = from_ecc_py('BN128', bn128)
 import py_eth_pairing
+import py_eth_pairing.jacobian
 BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+BN128JFQ, BN128JPoint = from_ecc_py('BN128J', py_eth_pairing.jacobian)
 
 class TestBM_BLS(unittest.TestCase):
     def test(self):
@@ -147,3 +248,171 @@ class TestBM_BLS(unittest.TestCase):
             self.assertTrue(bm.verify(pks, m, sigma))
 
         self.assertTrue(bm.verify_aggr_hm(pks, hms, sigmas))
+
+    def test_jacobian(self):
+        num_messages = 3
+        num_signers = 2
+
+        bm = BM_BLS(BN128JPoint, BN128JFQ, num_signers)
+        ms = [BN128JFQ.rand() for _ in range(num_messages)]
+        (pks, sks) = bm.keygen()
+        sigmas = [bm.sign(sks, pks, m) for m in ms]
+        for (m, sigma) in zip(ms, sigmas):
+            self.assertEqual(len(sigma.p), 3)
+            self.assertTrue(bm.verify(pks, m, sigma))
+        self.assertTrue(bm.verify_aggr(pks, ms, sigmas))
+
+        ks = [BN128JFQ.rand() for _ in range(4)]
+        ps = [bm.g1 * k for k in ks]
+        self.assertEqual(BN128JPoint.sum(ps), bm.g1 * BN128JFQ.sum(ks))
+        self.assertEqual(BN128JPoint.sum([ps[0], ps[0].neg()]), BN128JPoint(py_eth_pairing.jacobian.Z1))
+
+    def test_H_many(self):
+        bm = BM_BLS(BN128Point, BN128FQ, 1)
+        ms = [BN128FQ(0), BN128FQ.rand(), BN128FQ.rand(), BN128FQ(0)]
+        expected = [BN128Point(_hash_to_point(serialize((m,)), bm.domain)) for m in ms]
+        self.assertEqual(bm.H_many(ms), expected)
+        self.assertEqual([bm.H(m) for m in ms], expected)
+
+    def test_H_many_small_cache(self):
+        # batches larger than the hash_to_point cache must not read back evicted entries
+        cache = hash_to_point_module._cache
+        hash_to_point_module._cache = LRUCache(2)
+        try:
+            num_messages = 3
+            bm = BM_BLS(BN128Point, BN128FQ, 1)
+            (pks, sks) = bm.keygen()
+            ms = [BN128FQ.rand() for _ in range(num_messages)]
+            sigmas = bm.sign_many(sks, pks, ms)
+            bm.H(ms[0])
+            self.assertTrue(bm.verify_aggr(pks, ms, sigmas))
+            self.assertEqual(bm.H_many(ms + ms), [bm.H(m) for m in ms + ms])
+        finally:
+            hash_to_point_module._cache = cache
+
+    def test_msm(self):
+        bm = BM_BLS(BN128Point, BN128FQ, 1)
+        ks = [BN128FQ.rand() for _ in range(6)]
+        g1s = [bm.g1 * k for k in ks]
+        self.assertEqual(BN128Point.msm(g1s, ks), BN128Point.sum([p * k for (p, k) in zip(g1s, ks)]))
+        self.assertEqual(BN128Point.mul_many(g1s, ks), [p * k for (p, k) in zip(g1s, ks)])
+        k_sum = BN128FQ.sum(ks)
+        self.assertEqual(BN128Point.msm_g2([bm.g2] * len(ks), ks), BN128Point(multiply(bm.g2.p, k_sum.n)))
+
+    def test_fixed_base(self):
+        bm = BM_BLS(BN128Point, BN128FQ, 1)
+        # unreduced scalars, e.g. hash outputs, are reduced as by an untabled multiplication
+        for k in [BN128FQ(0), BN128FQ(1), BN128FQ.rand(), BN128FQ(BN128FQ.curve_order() - 1), BN128FQ(2**300 + 5), BN128FQ(-3)]:
+            self.assertEqual(bm.g1 * k, BN128Point(bm.g1.p) * k)
+            self.assertEqual(bm.g2 * k, BN128Point(multiply(bm.g2.p, k.n % BN128FQ.q)))
+
+    def test_committee_cache(self):
+        num_signers = 2
+
+        bm = BM_BLS(BN128Point, BN128FQ, num_signers, committee_cache_size=1)
+        (pks, _) = bm.keygen()
+        apk = bm.keyaggr(pks)
+        self.assertIs(bm.keyaggr(pks), apk)
+        self.assertEqual(bm._a(pks), bm._compute_a(pks))
+        g2_pks = [pk[1] for pk in pks]
+        self.assertEqual(bm._a(pks), [bm.H_agg(g2_pks, pk) for pk in g2_pks])
+
+        (other_pks, _) = bm.keygen()
+        bm.keyaggr(other_pks)
+        self.assertEqual(len(bm.committee_cache), 1)
+        self.assertIsNot(bm.keyaggr(pks), apk)
+        self.assertEqual(bm.keyaggr(pks), apk)
+
+    def test_executor(self):
+        m = BN128FQ.rand()
+        num_signers = 3
+        with ThreadPoolExecutor(num_signers) as executor:
+            bm = BM_BLS(BN128Point, BN128FQ, num_signers, executor=executor)
+            (pks, sks) = bm.keygen()
+            sigma = bm.sign(sks, pks, m)
+        self.assertTrue(bm.verify(pks, m, sigma))
+
+    def test_sign_async(self):
+        num_signers = 2
+        bm = BM_BLS(BN128Point, BN128FQ, num_signers)
+        (pks, sks) = bm.keygen()
+        ms = [BN128FQ.rand() for _ in range(2)]
+
+        async def sessions():
+            return await asyncio.gather(*[bm.sign_async(pks, m, bm.loopback_endpoints(sks, delay=0.01), timeout=5) for m in ms])
+
+        sigmas = asyncio.run(sessions())
+        for (m, sigma) in zip(ms, sigmas):
+            self.assertTrue(bm.verify(pks, m, sigma))
+
+    def test_sign_many(self):
+        num_messages = 4
+        num_signers = 3
+
+        bm = BM_BLS(BN128Point, BN128FQ, num_signers)
+        ms = [BN128FQ.rand() for _ in range(num_messages)]
+        (pks, sks) = bm.keygen()
+        sigmas = bm.sign_many(sks, pks, ms)
+        self.assertEqual(bm.verify_batch(pks, list(zip(ms, sigmas))), [])
+        self.assertTrue(bm.verify_aggr(pks, ms, sigmas))
+
+    def test_byte_count(self):
+        num_signers = 3
+        bm = BM_BLS(BN128Point, BN128FQ, num_signers)
+        (pks, sks) = bm.keygen()
+        m = BN128FQ.rand()
+        for x in [m, bm.g1, bm.g2, BN128JPoint.G1() * m, (m, [bm.g1, 'agg'], b'xy'), pks]:
+            self.assertEqual(encoded_size(x), len(serialize(x)))
+        self.assertEqual(encoded_size(bm.g1, bm.g2, compressed=True), 32 + 64)
+
+        counter = ByteCounter()
+        sigma = multi_controller(
+            byte_count_decorator(lambda: bm.U(m, pks), counter, 'U'),
+            [byte_count_decorator((lambda sk: lambda: bm.S(sk))(sk), counter, 'S') for sk in sks]
+        )
+        self.assertTrue(bm.verify(pks, m, sigma))
+        self.assertEqual(counter.totals()['U[0]'], {'sent': 64 * num_signers, 'received': 64 * num_signers})
+        self.assertEqual(
+            [row for row in counter.report() if row['party'] == 'S[2]'],
+            [{'party': 'S[2]', 'round': 0, 'sent': 0, 'received': 64}, {'party': 'S[2]', 'round': 1, 'sent': 64, 'received': 0}]
+        )
+
+    def test_redeem(self):
+        bm = BM_BLS(BN128Point, BN128FQ, 2)
+        (pks, sks) = bm.keygen()
+        m = BN128FQ.rand()
+        sigma = bm.sign(sks, pks, m)
+        ledger = RedemptionLedger()
+        self.assertTrue(bm.redeem(pks, m, sigma, ledger))
+        self.assertFalse(bm.redeem(pks, m, sigma, ledger))
+
+    def test_aggr_multi(self):
+        num_signers = 2
+
+        bm = BM_BLS(BN128Point, BN128FQ, num_signers)
+        batches = []
+        for num_messages in [1, 2]:
+            ms = [BN128FQ.rand() for _ in range(num_messages)]
+            (pks, sks) = bm.keygen()
+            sigmas = [bm.sign(sks, pks, m) for m in ms]
+            batches.append((pks, ms, sigmas))
+        self.assertTrue(bm.verify_aggr_multi(batches))
+
+        (pks, ms, sigmas) = batches[1]
+        batches[1] = (pks, [ms[1], ms[1]], sigmas)
+        self.assertFalse(bm.verify_aggr_multi(batches))
+
+    def test_verify_batch(self):
+        num_messages = 5
+        num_signers = 2
+
+        bm = BM_BLS(BN128Point, BN128FQ, num_signers)
+        ms = [BN128FQ.rand() for _ in range(num_messages)]
+        (pks, sks) = bm.keygen()
+        sigmas = [bm.sign(sks, pks, m) for m in ms]
+        items = list(zip(ms, sigmas))
+        self.assertEqual(bm.verify_batch(pks, items), [])
+
+        items[1] = (ms[1], sigmas[2])
+        items[3] = (BN128FQ.rand(), sigmas[3])
+        self.assertEqual(bm.verify_batch(pks, items), [1, 3])
@@ -1,22 +1,34 @@
 from hashlib import sha256
+from typing import List
 from unittest import TestCase
-from utils import serialize, controller, multi_controller
+from concurrent.futures import ThreadPoolExecutor
+from utils import serialize, controller, multi_controller, async_multi_controller, LoopbackEndpoint, Transcript, BufferedHash
 from ec import ECPoint, FQ
 
 class BM_SBException(Exception):
     pass
 
 class BM_SB:
-    def __init__(self, ec_point: ECPoint, fq: FQ, max_int_size, hash, num_of_signers):
+    def __init__(self, ec_point: ECPoint, fq: FQ, max_int_size, hash, num_of_signers, executor=None, hash_ctor=None):
         self.ec_point = ec_point
         self.fq = fq
         self.max_int_size = max_int_size
+        # hashlib-style constructor computing the same digest as hash, enables incremental hashing;
+        # either one may be None and is derived from the other
+        if hash is None:
+            hash = lambda x: hash_ctor(x).digest()
         self.hash = hash
+        self.hash_ctor = hash_ctor if hash_ctor is not None else BufferedHash.ctor(hash)
+        h = self.hash_ctor()
+        h.update(b"DOMAIN_BM_SB")
+        if h.digest() != self.hash(b"DOMAIN_BM_SB"):
+            raise ValueError('hash and hash_ctor compute different digests')
         self.domain = self.hash(b"DOMAIN_BM_SB")
         self.num_of_signers = num_of_signers
+        self.executor = executor # e.g. a ThreadPoolExecutor to run each round's signer steps concurrently
         self.g = ec_point.G1()
         #self.h = self.g * self.fq.rand()
-        self.h = self.g * fq(3)
+        self.h = (self.g * fq(3)).precompute()
 
     def _H(self, *args) -> int:
         return int.from_bytes(
@@ -31,6 +43,15 @@ class BM_SB:
         #return self._H_FQ(b"sig", *args)
         return self._H_FQ(*args)
 
+    def committee_transcript(self, pks) -> Transcript:
+        return Transcript(self.hash_ctor, self.domain, pks)
+
+    def H_sig_committee(self, pks, m, R_bar, transcript: Transcript = None) -> List[FQ]:
+        # [H_sig(pks, pk, m, R_bar) for pk in pks] with (domain, pks) absorbed once; pass the
+        # committee_transcript(pks) to share it across many tokens
+        t = transcript if transcript is not None else self.committee_transcript(pks)
+        return [self.fq(int.from_bytes(t.digest(pk, m, R_bar), 'big')) for pk in pks]
+
     def H_com(self, *args) -> FQ:
         #return self._H_FQ(b"com", *args)
         return self._H_FQ(*args)
@@ -51,27 +72,49 @@ class BM_SB:
 
     def verify(self, pks, m, sigma):
         (R_bar, y_bar, z_bar) = sigma
-        c_i_bar = [self.H_sig(pks, pk, m, R_bar) for pk in pks]
+        c_i_bar = self.H_sig_committee(pks, m, R_bar)
 
-        LHS = R_bar + self.ec_point.sum(
-            [pks[i] * (c_i_bar[i] + y_bar**3) for i in range(self.num_of_signers)]
-        )
+        y_bar_cubed = y_bar**3
+        LHS = R_bar + self.ec_point.msm(pks, [c_i_bar[i] + y_bar_cubed for i in range(self.num_of_signers)])
         RHS = self.g * z_bar + self.h * y_bar
         R_bar_check = LHS == RHS
 
         return y_bar != 0 and R_bar_check
 
-    def U_sign(self, pks, m, S):
-        A_i = []
-        B_i = []
-        com_i = []
-        beta_i = []
-        for s in S:
-            (A, B, com) = s.send(())
-            A_i.append(A)
-            B_i.append(B)
-            com_i.append(com)
-            beta_i.append(self.fq.rand())
+    def redeem(self, pks, m, sigma, ledger):
+        # verifies the token and records it in a RedemptionLedger, False if invalid or already spent
+        return self.verify(pks, m, sigma) and ledger.spend(m)
+
+    def verify_batch(self, pks, items):
+        # returns the indices of the (m, sigma) pairs that fail verification
+        t = self.committee_transcript(pks)
+        cs = [self.H_sig_committee(pks, m, sigma[0], t) for (m, sigma) in items]
+        sigmas = [sigma for (_, sigma) in items]
+        failed = [k for k in range(len(items)) if sigmas[k][1] == 0]
+        indices = [k for k in range(len(items)) if sigmas[k][1] != 0]
+        return sorted(failed + self._bisect(pks, sigmas, cs, indices))
+
+    def _bisect(self, pks, sigmas, cs, indices):
+        if not indices or self._verify_combined(pks, sigmas, cs, indices):
+            return []
+        if len(indices) == 1:
+            return indices
+
+        mid = len(indices) // 2
+        return self._bisect(pks, sigmas, cs, indices[:mid]) + self._bisect(pks, sigmas, cs, indices[mid:])
+
+    def _verify_combined(self, pks, sigmas, cs, indices):
+        # a single signature needs no randomization
+        weights = [self.fq(1)] if len(indices) == 1 else [self.fq.rand() for _ in indices]
+        (points, scalars, g_scalar, h_scalar) = self._verify_terms(pks, [sigmas[k] for k in indices], [cs[k] for k in indices], weights)
+        return self.ec_point.msm(points, scalars) == self.g * g_scalar + self.h * h_scalar
+
+    def U_sign(self, pks, m):
+        commitments = yield [()] * self.num_of_signers
+        A_i = [A for (A, _, _) in commitments]
+        B_i = [B for (_, B, _) in commitments]
+        com_i = [com for (_, _, com) in commitments]
+        beta_i = [self.fq.rand() for _ in range(self.num_of_signers)]
 
         alpha = self.rand()
         r = self.fq.rand()
@@ -80,41 +123,41 @@ class BM_SB:
         A_sum = self.ec_point.sum(A_i)
         B_sum = self.ec_point.sum(B_i)
         alpha_cubed = alpha**3
-        R_bar = self.ec_point.sum(
-            [
-                self.g * r,
-                self.ec_point.sum([pks[i] * (alpha_cubed * beta_i[i]) for i in range(self.num_of_signers)]),
-                A_sum * alpha_cubed,
-                B_sum * alpha,
-            ]
+        R_bar = self.g * r + self.ec_point.msm(
+            [*pks, A_sum, B_sum],
+            [*[alpha_cubed * beta_i[i] for i in range(self.num_of_signers)], alpha_cubed, alpha]
         )
 
-        alpha_neg_cubed = alpha**(-3)
+        alpha_neg_cubed = alpha_cubed**(-1)
 
+        c_i = self.H_sig_committee(pks, m, R_bar)
         c_j = []
-        b_i = []
-        y_i = []
-        for i, s in enumerate(S):
-            c_j.append(self.H_sig(pks, pks[i], m, R_bar) * alpha_neg_cubed + beta_i[i])
+        challenges = []
+        for i in range(self.num_of_signers):
+            c_j.append(c_i[i] * alpha_neg_cubed + beta_i[i])
             com_ic = com_i.copy()
             com_ic[i] = b''
-            b, y = s.send((c_j[i], com_ic))
-            b_i.append(b)
-            y_i.append(y)
+            challenges.append((c_j[i], com_ic))
 
-        z_i = []
-        for i, s in enumerate(S):
+        reveals = yield challenges
+        b_i = [b for (b, _) in reveals]
+        y_i = [y for (_, y) in reveals]
+
+        y_ics = []
+        for i in range(self.num_of_signers):
             y_ic = y_i.copy()
             y_ic[i] = b''
-            z = s.send(y_ic)
-            z_i.append(z)
+            y_ics.append(y_ic)
+
+        z_i = yield y_ics
 
         b_sum = self.fq.sum(b_i)
         y_sum = self.fq.sum(y_i)
         z_sum = self.fq.sum(z_i)
 
         B_check = B_sum == self.g * b_sum + self.h * y_sum
-        A_check = self.g * z_sum == A_sum + self.ec_point.sum([pks[i] * (c_j[i] + y_sum**3) for i in range(self.num_of_signers)])
+        y_sum_cubed = y_sum**3
+        A_check = self.g * z_sum == A_sum + self.ec_point.msm(pks, [c_j[i] + y_sum_cubed for i in range(self.num_of_signers)])
         if not A_check or not B_check:
             raise BM_SBException("ABORT")
 
@@ -125,7 +168,7 @@ class BM_SB:
         if not self.verify(pks, m, sigma):
             raise BM_SBException("ABORT")
 
-        yield sigma
+        return sigma
 
     def S_sign(self, i, pk, sk):
         yield
@@ -150,29 +193,282 @@ class BM_SB:
         z = (a + (c + y_sum**3) * sk)
         yield z
 
+    def _verify_terms(self, pks, sigmas, cs, weights):
+        # sum_k w_k * (R_bar_k + sum_i pk_i * (c_ik + y_bar_k^3)) == g * sum_k w_k z_bar_k + h * sum_k w_k y_bar_k
+        # as (points, scalars, g scalar, h scalar)
+        zero = self.fq(0)
+        pk_scalars = [zero] * self.num_of_signers
+        for ((_, y_bar, _), c_i, w) in zip(sigmas, cs, weights):
+            y_bar_cubed = y_bar**3
+            pk_scalars = self.fq.vadd(pk_scalars, [w * (c + y_bar_cubed) for c in c_i])
+        points = [R_bar for (R_bar, _, _) in sigmas] + list(pks)
+        scalars = list(weights) + pk_scalars
+        g_scalar = self.fq.inner_product(weights, [z_bar for (_, _, z_bar) in sigmas])
+        h_scalar = self.fq.inner_product(weights, [y_bar for (_, y_bar, _) in sigmas])
+        return (points, scalars, g_scalar, h_scalar)
+
+    def U_sign_many(self, pks, ms):
+        # same three rounds as U_sign, every message carries one entry per token
+        K = len(ms)
+        n = self.num_of_signers
+        commitments = yield [()] * n
+        A_sum = [self.ec_point.sum([A[k] for (A, _, _) in commitments]) for k in range(K)]
+        B_sum = [self.ec_point.sum([B[k] for (_, B, _) in commitments]) for k in range(K)]
+        com_i = [com for (_, _, com) in commitments]
+        beta = [[self.fq.rand() for _ in range(n)] for _ in range(K)]
+
+        alpha = [self.rand() for _ in range(K)]
+        r = [self.fq.rand() for _ in range(K)]
+        alpha_cubed = [alpha_k**3 for alpha_k in alpha]
+        R_bar = [
+            self.g * r[k] + self.ec_point.msm(
+                [*pks, A_sum[k], B_sum[k]],
+                [*[alpha_cubed[k] * beta[k][i] for i in range(n)], alpha_cubed[k], alpha[k]]
+            )
+            for k in range(K)
+        ]
+        alpha_neg_cubed = self.fq.batch_inv(alpha_cubed)
+
+        t = self.committee_transcript(pks)
+        c = [self.H_sig_committee(pks, ms[k], R_bar[k], t) for k in range(K)]
+        c_j = [[c[k][i] * alpha_neg_cubed[k] + beta[k][i] for i in range(n)] for k in range(K)]
+        challenges = []
+        for i in range(n):
+            com_ic = com_i.copy()
+            com_ic[i] = b''
+            challenges.append(([c_j[k][i] for k in range(K)], com_ic))
+
+        reveals = yield challenges
+        b_i = [b for (b, _) in reveals]
+        y_i = [y for (_, y) in reveals]
+
+        y_ics = []
+        for i in range(n):
+            y_ic = y_i.copy()
+            y_ic[i] = b''
+            y_ics.append(y_ic)
+
+        z_i = yield y_ics
+
+        b_sum = [self.fq.sum([b[k] for b in b_i]) for k in range(K)]
+        y_sum = [self.fq.sum([y[k] for y in y_i]) for k in range(K)]
+        z_sum = [self.fq.sum([z[k] for z in z_i]) for k in range(K)]
+
+        sigmas = []
+        for k in range(K):
+            z_bar = r[k] + alpha_cubed[k] * z_sum[k] + alpha[k] * b_sum[k]
+            y_bar = alpha[k] * y_sum[k]
+            sigmas.append((R_bar[k], y_bar, z_bar))
+        if any(y_bar == 0 for (_, y_bar, _) in sigmas):
+            raise BM_SBException("ABORT")
+
+        # B_check, A_check and verify of every token folded into one equation with random weights:
+        #   B_sum_k == g b_sum_k + h y_sum_k
+        #   A_sum_k + sum_i pk_i (c_j_ik + y_sum_k^3) == g z_sum_k
+        #   R_bar_k + sum_i pk_i (c_ik + y_bar_k^3) == g z_bar_k + h y_bar_k
+        rho = [self.fq.rand() for _ in range(K)]
+        tau = [self.fq.rand() for _ in range(K)]
+        weights = [self.fq.rand() for _ in range(K)]
+        (points, scalars, g_scalar, h_scalar) = self._verify_terms(pks, sigmas, c, weights)
+        for k in range(K):
+            y_sum_cubed = y_sum[k]**3
+            scalars[K:] = self.fq.vadd(scalars[K:], [tau[k] * (c_j[k][i] + y_sum_cubed) for i in range(n)])
+        points += B_sum + A_sum
+        scalars += rho + tau
+        g_scalar = g_scalar + self.fq.inner_product(rho, b_sum) + self.fq.inner_product(tau, z_sum)
+        h_scalar = h_scalar + self.fq.inner_product(rho, y_sum)
+        if self.ec_point.msm(points, scalars) != self.g * g_scalar + self.h * h_scalar:
+            raise BM_SBException("ABORT")
+
+        return sigmas
+
+    def S_sign_many(self, i, pk, sk, K):
+        yield
+        a = [self.fq.rand() for _ in range(K)]
+        b = [self.fq.rand() for _ in range(K)]
+        y = [self.rand() for _ in range(K)]
+
+        A = [self.g * a_k for a_k in a]
+        B = [self.g * b_k + self.h * y_k for (b_k, y_k) in zip(b, y)]
+        com = self.H_com_many(i, y)
+
+        c, com_i = yield (A, B, com)
+        y_i = yield (b, y)
+
+        com_i[i] = com
+        y_i[i] = y
+
+        if any(com_i[j] != self.H_com_many(j, y_i[j]) for j in range(self.num_of_signers)):
+            raise BM_SBException("ABORT")
+
+        z = []
+        for k in range(K):
+            y_sum = self.fq.sum([y_j[k] for y_j in y_i])
+            z.append(a[k] + (c[k] + y_sum**3) * sk)
+        yield z
+
+    def H_com_many(self, i, ys) -> List[FQ]:
+        # [H_com(i, y) for y in ys] with (domain, i) absorbed once
+        t = Transcript(self.hash_ctor, self.domain, i)
+        return [self.fq(int.from_bytes(t.digest(y), 'big')) for y in ys]
+
+    def sign_many(self, pks, sks, ms):
+        return multi_controller(
+            lambda: self.U_sign_many(pks, ms),
+            [(lambda i, pk, sk: lambda *args: self.S_sign_many(i, pk, sk, len(ms), *args))(i, pks[i], sks[i]) for i in range(self.num_of_signers)],
+            self.executor
+        )
+
     def sign(self, pks, sks, m):
         return multi_controller(
-            lambda *args: self.U_sign(pks, m, *args),
-            [(lambda i, pk, sk: lambda *args: self.S_sign(i, pk, sk, *args))(i, pks[i], sks[i]) for i in range(self.num_of_signers)]
+            lambda: self.U_sign(pks, m),
+            [(lambda i, pk, sk: lambda *args: self.S_sign(i, pk, sk, *args))(i, pks[i], sks[i]) for i in range(self.num_of_signers)],
+            self.executor
         )
 
+    async def sign_async(self, pks, m, endpoints, timeout=None):
+        # endpoints[i] is an async transport to the i-th signer running S_sign
+        return await async_multi_controller(lambda: self.U_sign(pks, m), endpoints, timeout)
+
+    def loopback_endpoints(self, pks, sks, delay=0, codec=None):
+        return [LoopbackEndpoint((lambda i: lambda: self.S_sign(i, pks[i], sks[i]))(i), delay, codec) for i in range(self.num_of_signers)]
+
+import asyncio
 from ec import from_ecc_py
+from ledger import RedemptionLedger, BloomFilter
+from compression import PointCodec
+from hashlib import sha512
 # from py_ecc import optimized_bn128 as bn128, optimized_bls12_381 as bls12_381
 # from py_ecc import bn128, bls12_381
 import py_eth_pairing
+import py_eth_pairing.jacobian
 # BN128FQ, BN128Point = from_ecc_py('BN128', bn128)
 BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+BN128JFQ, BN128JPoint = from_ecc_py('BN128J', py_eth_pairing.jacobian)
 # BLS12381FQ, BLS12381Point = from_ecc_py('BLS12381', bls12_381)
 
 class TestBM_SB(TestCase):
     def test(self):
         # for ec_point, fq, max_int_size in [(BLS12381Point, BLS12381FQ, 64), (BN128Point, BN128FQ, 32)]:
-        for ec_point, fq, max_int_size in [(BN128Point, BN128FQ, 32)]:
+        for ec_point, fq, max_int_size in [(BN128Point, BN128FQ, 32), (BN128JPoint, BN128JFQ, 32)]:
             with self.subTest(msg=f"Testing with {ec_point.__name__} and {fq.__name__}"):
-                m = BN128FQ.rand()
+                m = fq.rand()
                 num_of_signers = 1
                 hash = lambda x: sha256(x).digest()
-                bm = BM_SB(ec_point, fq, max_int_size, hash, num_of_signers)
+                bm = BM_SB(ec_point, fq, max_int_size, hash, num_of_signers, hash_ctor=sha256)
                 (sks, pks) = bm.keygen()
                 sigma = bm.sign(pks, sks, m)
                 self.assertTrue(bm.verify(pks, m, sigma))
+
+    def test_fq(self):
+        xs = [BN128FQ.rand() for _ in range(5)]
+        ys = [BN128FQ.rand() for _ in range(5)]
+        self.assertEqual(BN128FQ.sum(xs), xs[0] + xs[1] + xs[2] + xs[3] + xs[4])
+        self.assertEqual(BN128FQ.inner_product(xs, ys), BN128FQ.sum([x * y for (x, y) in zip(xs, ys)]))
+        with self.assertRaises(AttributeError):
+            xs[0].m = 1
+
+        self.assertEqual(BN128FQ.vadd(xs, ys), [x + y for (x, y) in zip(xs, ys)])
+        self.assertEqual(BN128FQ.vmul(xs, ys), [x * y for (x, y) in zip(xs, ys)])
+        self.assertEqual(BN128FQ.batch_inv(xs), [x**(-1) for x in xs])
+        self.assertEqual(BN128FQ.batch_inv([]), [])
+        with self.assertRaises(ZeroDivisionError):
+            BN128FQ.batch_inv([xs[0], BN128FQ(0)])
+
+    def test_H_sig_committee(self):
+        m = BN128FQ.rand()
+        num_of_signers = 3
+        hash = lambda x: sha256(x).digest()
+        for hash_ctor in [None, sha256]:
+            bm = BM_SB(BN128Point, BN128FQ, 32, hash, num_of_signers, hash_ctor=hash_ctor)
+            (sks, pks) = bm.keygen()
+            R_bar = bm.g * BN128FQ.rand()
+            self.assertEqual(bm.H_sig_committee(pks, m, R_bar), [bm.H_sig(pks, pk, m, R_bar) for pk in pks])
+            t = bm.committee_transcript(pks)
+            for m_ in [m, m + BN128FQ(1)]:
+                self.assertEqual(bm.H_sig_committee(pks, m_, R_bar, t), [bm.H_sig(pks, pk, m_, R_bar) for pk in pks])
+        self.assertEqual(BM_SB(BN128Point, BN128FQ, 32, None, num_of_signers, hash_ctor=sha256).hash(b'x'), hash(b'x'))
+        with self.assertRaises(ValueError):
+            BM_SB(BN128Point, BN128FQ, 32, hash, num_of_signers, hash_ctor=sha512)
+
+    def test_executor(self):
+        m = BN128FQ.rand()
+        num_of_signers = 3
+        hash = lambda x: sha256(x).digest()
+        with ThreadPoolExecutor(num_of_signers) as executor:
+            bm = BM_SB(BN128Point, BN128FQ, 32, hash, num_of_signers, executor)
+            (sks, pks) = bm.keygen()
+            sigma = bm.sign(pks, sks, m)
+        self.assertTrue(bm.verify(pks, m, sigma))
+
+    def test_sign_async(self):
+        num_of_signers = 3
+        hash = lambda x: sha256(x).digest()
+        bm = BM_SB(BN128Point, BN128FQ, 32, hash, num_of_signers)
+        (sks, pks) = bm.keygen()
+        ms = [BN128FQ.rand() for _ in range(2)]
+
+        async def sessions():
+            return await asyncio.gather(*[bm.sign_async(pks, m, bm.loopback_endpoints(pks, sks, delay=0.01), timeout=5) for m in ms])
+
+        sigmas = asyncio.run(sessions())
+        for (m, sigma) in zip(ms, sigmas):
+            self.assertTrue(bm.verify(pks, m, sigma))
+
+        endpoints = bm.loopback_endpoints(pks, sks)
+        endpoints[1].delay = 1
+        with self.assertRaises(TimeoutError):
+            asyncio.run(bm.sign_async(pks, ms[0], endpoints, timeout=0.1))
+
+        endpoints = bm.loopback_endpoints(pks, sks, codec=PointCodec(BN128Point, BN128FQ))
+        self.assertTrue(bm.verify(pks, ms[0], asyncio.run(bm.sign_async(pks, ms[0], endpoints))))
+        self.assertTrue(all(e.bytes_sent > 0 and e.bytes_received > 0 for e in endpoints))
+
+    def test_sign_many(self):
+        num_of_signers = 3
+        hash = lambda x: sha256(x).digest()
+        bm = BM_SB(BN128Point, BN128FQ, 32, hash, num_of_signers, hash_ctor=sha256)
+        (sks, pks) = bm.keygen()
+        ms = [BN128FQ.rand() for _ in range(4)]
+        sigmas = bm.sign_many(pks, sks, ms)
+        self.assertEqual(len(sigmas), len(ms))
+        for (m, sigma) in zip(ms, sigmas):
+            self.assertTrue(bm.verify(pks, m, sigma))
+        self.assertEqual(bm.H_com_many(1, [sigma[1] for sigma in sigmas]), [bm.H_com(1, sigma[1]) for sigma in sigmas])
+
+    def test_verify_batch(self):
+        num_of_signers = 2
+        hash = lambda x: sha256(x).digest()
+        bm = BM_SB(BN128Point, BN128FQ, 32, hash, num_of_signers, hash_ctor=sha256)
+        (sks, pks) = bm.keygen()
+        ms = [BN128FQ.rand() for _ in range(5)]
+        sigmas = bm.sign_many(pks, sks, ms)
+        items = list(zip(ms, sigmas))
+        self.assertEqual(bm.verify_batch(pks, items), [])
+
+        (R_bar, y_bar, z_bar) = sigmas[0]
+        items[0] = (ms[0], (R_bar, y_bar, z_bar + BN128FQ(1)))
+        items[2] = (ms[3], sigmas[2])
+        items[4] = (ms[4], (R_bar, BN128FQ(0), z_bar))
+        self.assertEqual(bm.verify_batch(pks, items), [0, 2, 4])
+
+    def test_redeem(self):
+        hash = lambda x: sha256(x).digest()
+        bm = BM_SB(BN128Point, BN128FQ, 32, hash, 2, hash_ctor=sha256)
+        (sks, pks) = bm.keygen()
+        ms = [BN128FQ.rand() for _ in range(2)]
+        sigmas = bm.sign_many(pks, sks, ms)
+        ledger = RedemptionLedger(bloom=BloomFilter(1 << 10))
+        self.assertFalse(bm.redeem(pks, ms[0], sigmas[1], ledger))
+        self.assertTrue(bm.redeem(pks, ms[0], sigmas[0], ledger))
+        self.assertFalse(bm.redeem(pks, ms[0], sigmas[0], ledger))
+        self.assertTrue(bm.redeem(pks, ms[1], sigmas[1], ledger))
+
+    def test_sign_many_abort(self):
+        num_of_signers = 2
+        hash = lambda x: sha256(x).digest()
+        bm = BM_SB(BN128Point, BN128FQ, 32, hash, num_of_signers, hash_ctor=sha256)
+        (sks, pks) = bm.keygen()
+        sks[1] = sks[1] + BN128FQ(1)
+        with self.assertRaises(BM_SBException):
+            bm.sign_many(pks, sks, [BN128FQ.rand() for _ in range(3)])
@@ -0,0 +1,339 @@
+from py_ecc import optimized_bn128
+from py_ecc.bn128 import FQ2, field_modulus as q, b2
+from ec import ECPoint, FQ
+from utils import LRUCache, SerializationError, _write
+
+# Compressed points are the big-endian x coordinate with flags in the two spare top bits of the
+# first byte (q < 2^254): SIGN when y is the larger of its two roots, INFINITY for the point at
+# infinity. G1 takes 32 bytes, G2 64 bytes as x.c0 | x.c1 (the coefficient order of the token
+# store); an FQ2 is larger if its c1 is, or its c0 when c1 is zero. Hashing keeps serialize().
+WORD_SIZE = 32
+G1_SIZE = WORD_SIZE
+G2_SIZE = 2 * WORD_SIZE
+SIGN = 0x80
+INFINITY = 0x40
+HALF = (q - 1) // 2
+
+# the same committee keys and tokens are decompressed over and over, the square roots are cached
+DECOMPRESS_CACHE_SIZE = 4096
+_cache = LRUCache(DECOMPRESS_CACHE_SIZE)
+
+def _int(x) -> int:
+    return x if isinstance(x, int) else x.n
+
+def _affine(p):
+    if isinstance(p, ECPoint):
+        p = p.normalize().p
+    return p
+
+def _is_g2(p):
+    return hasattr(p[0], 'coeffs')
+
+def _fq2_is_larger(y) -> bool:
+    (c0, c1) = map(_int, y.coeffs)
+    return c1 > HALF if c1 != 0 else c0 > HALF
+
+def _flags_and_x(b: bytes, size: int):
+    if len(b) != size:
+        raise SerializationError(f'Compressed point must be {size} bytes, got {len(b)}')
+    return (b[0] & (SIGN | INFINITY), bytes([b[0] & ~(SIGN | INFINITY) & 0xff]) + b[1:])
+
+def _infinity(size: int) -> bytes:
+    return bytes([INFINITY]) + bytes(size - 1)
+
+def compress_g1(p) -> bytes:
+    p = _affine(p)
+    if p is None or (_int(p[0]) == 0 and _int(p[1]) == 0):
+        return _infinity(G1_SIZE)
+    out = bytearray(_int(p[0]).to_bytes(WORD_SIZE, 'big'))
+    if _int(p[1]) > HALF:
+        out[0] |= SIGN
+    return bytes(out)
+
+def compress_g2(p) -> bytes:
+    p = _affine(p)
+    if p is None:
+        return _infinity(G2_SIZE)
+    out = bytearray(b''.join(_int(c).to_bytes(WORD_SIZE, 'big') for c in p[0].coeffs))
+    if _fq2_is_larger(p[1]):
+        out[0] |= SIGN
+    return bytes(out)
+
+def compress(p) -> bytes:
+    p = _affine(p)
+    if p is None:
+        raise SerializationError('The group of a point at infinity is ambiguous, use compress_g1/compress_g2')
+    return compress_g2(p) if _is_g2(p) else compress_g1(p)
+
+def sqrt_fq2(a: FQ2):
+    # q = 3 mod 4: algorithm 9 of Adj and Rodriguez-Henriquez, "Square root computation over even
+    # extension fields"; alpha^q is the conjugate of alpha. None if a is not a square
+    minus_one = FQ2([q - 1, 0])
+    a1 = a ** ((q - 3) // 4)
+    alpha = a1 * a1 * a
+    if FQ2([alpha.coeffs[0], -alpha.coeffs[1]]) * alpha == minus_one:
+        return None
+    x0 = a1 * a
+    if alpha == minus_one:
+        x = FQ2([0, 1]) * x0
+    else:
+        x = (FQ2.one() + alpha) ** ((q - 1) // 2) * x0
+    return x if x * x == a else None
+
+# G2 membership without a 254-bit multiplication (Dai et al., eprint 2022/348): with u the BN
+# parameter and psi the untwist-Frobenius-twist endomorphism, a twist point P is in G2 iff
+# [u+1]P + psi([u]P) + psi^2([u]P) == psi^3([2u]P). Projective coordinates avoid the inversions
+BN_U = 4965661367192848881
+_XI = optimized_bn128.FQ2([9, 1]) # b2 == 3 / xi
+_PSI_X = _XI ** ((q - 1) // 3)
+_PSI_Y = _XI ** ((q - 1) // 2)
+
+def _conjugate(a):
+    return optimized_bn128.FQ2([a.coeffs[0], -a.coeffs[1]])
+
+def _psi(p):
+    (x, y, z) = p
+    return (_conjugate(x) * _PSI_X, _conjugate(y) * _PSI_Y, _conjugate(z))
+
+def is_in_g2(p) -> bool:
+    # p an affine point on the twist, None at infinity as in py_ecc
+    if p is None:
+        return True
+    p = tuple(optimized_bn128.FQ2([_int(c) for c in v.coeffs]) for v in p) + (optimized_bn128.FQ2.one(),)
+    up = optimized_bn128.multiply(p, BN_U)
+    lhs = optimized_bn128.add(optimized_bn128.add(optimized_bn128.add(up, p), _psi(up)), _psi(_psi(up)))
+    return optimized_bn128.eq(lhs, _psi(_psi(_psi(optimized_bn128.double(up)))))
+
+def _decompress_g1(b: bytes):
+    (flags, x) = _flags_and_x(b, G1_SIZE)
+    x = int.from_bytes(x, 'big')
+    if flags & INFINITY:
+        if flags & SIGN or x != 0:
+            raise SerializationError('Invalid encoding of the point at infinity')
+        return (0, 0)
+    if x >= q:
+        raise SerializationError('Coordinate is not a field element')
+    y2 = (x * x * x + 3) % q
+    y = pow(y2, (q + 1) // 4, q)
+    if y * y % q != y2:
+        raise SerializationError('Point is not on G1')
+    if (y > HALF) != bool(flags & SIGN):
+        y = q - y
+    return (x, y)
+
+def _decompress_g2(b: bytes):
+    (flags, x) = _flags_and_x(b, G2_SIZE)
+    (c0, c1) = (int.from_bytes(x[:WORD_SIZE], 'big'), int.from_bytes(x[WORD_SIZE:], 'big'))
+    if flags & INFINITY:
+        if flags & SIGN or c0 != 0 or c1 != 0:
+            raise SerializationError('Invalid encoding of the point at infinity')
+        return None
+    if c0 >= q or c1 >= q:
+        raise SerializationError('Coordinate is not a field element')
+    x = FQ2([c0, c1])
+    y = sqrt_fq2(x ** 3 + b2)
+    if y is None:
+        raise SerializationError('Point is not on the G2 twist')
+    if _fq2_is_larger(y) != bool(flags & SIGN):
+        y = -y
+    # unlike G1, the twist has a cofactor
+    if not is_in_g2((x, y)):
+        raise SerializationError('Point is not in G2')
+    return (x, y)
+
+def _cached(decompress, b):
+    b = bytes(b)
+    p = _cache.get(b)
+    if p is None:
+        p = decompress(b)
+        _cache.put(b, p)
+    return p
+
+def decompress_g1(b):
+    # affine (x, y) ints, (0, 0) at infinity as in py_eth_pairing
+    return _cached(_decompress_g1, b)
+
+def decompress_g2(b):
+    # affine (x, y) FQ2s, None at infinity as in py_ecc
+    return _cached(_decompress_g2, b)
+
+def compress_many(points, g2=False) -> bytes:
+    # e.g. a committee's keys or a batch of tokens on the wire
+    return b''.join(map(compress_g2 if g2 else compress_g1, points))
+
+def decompress_many(b, ec_point: ECPoint = None, g2=False) -> list:
+    (size, decompress) = (G2_SIZE, decompress_g2) if g2 else (G1_SIZE, decompress_g1)
+    if len(b) % size != 0:
+        raise SerializationError(f'Length {len(b)} is not a multiple of {size}')
+    ps = [decompress(b[i:i + size]) for i in range(0, len(b), size)]
+    return [ec_point(p) for p in ps] if ec_point is not None else ps
+
+def _write_compressed(out: bytearray, x):
+    if isinstance(x, ECPoint):
+        out += compress(x)
+    elif isinstance(x, (list, tuple)) and any(isinstance(y, (ECPoint, list, tuple)) for y in x):
+        for y in x:
+            _write_compressed(out, y)
+    else:
+        _write(out, x)
+
+def serialize_compressed(*args) -> bytes:
+    # serialize() with every ECPoint compressed, len() == encoded_size(*args, compressed=True)
+    out = bytearray()
+    for x in args:
+        _write_compressed(out, x)
+    return bytes(out)
+
+class PointCodec:
+    # self-describing wire encoding of protocol messages, e.g. for LoopbackEndpoint(codec=...): a tag
+    # byte per value, then the compressed point, 32 bytes for field elements and non-negative ints,
+    # a 4-byte length and the data for bytes and str, or a 4-byte count and the items for tuples and
+    # lists. Decoded points are ec_point instances and field elements fq instances
+    G1, G2, FIELD, INT, BYTES, STR, TUPLE, LIST, NONE = b'GHFIBSTLN'
+
+    def __init__(self, ec_point: ECPoint, fq: FQ):
+        self.ec_point = ec_point
+        self.fq = fq
+
+    def _encode(self, out: bytearray, x):
+        if x is None:
+            out.append(self.NONE)
+        elif isinstance(x, ECPoint):
+            p = _affine(x)
+            g2 = p is not None and _is_g2(p)
+            out.append(self.G2 if g2 else self.G1)
+            out += compress_g2(p) if g2 else compress_g1(p)
+        elif isinstance(x, FQ):
+            out.append(self.FIELD)
+            out += x.n.to_bytes(WORD_SIZE, 'big')
+        elif isinstance(x, int):
+            if x < 0:
+                raise ValueError('Cannot encode a negative int')
+            out.append(self.INT)
+            out += x.to_bytes(WORD_SIZE, 'big')
+        elif isinstance(x, (bytes, bytearray, str)):
+            data = x.encode('utf-8') if isinstance(x, str) else x
+            out.append(self.STR if isinstance(x, str) else self.BYTES)
+            out += len(data).to_bytes(4, 'big') + data
+        elif isinstance(x, (tuple, list)):
+            out.append(self.TUPLE if isinstance(x, tuple) else self.LIST)
+            out += len(x).to_bytes(4, 'big')
+            for y in x:
+                self._encode(out, y)
+        else:
+            raise SerializationError(f'Cannot encode argument of type {type(x)}')
+
+    def encode(self, msg) -> bytes:
+        out = bytearray()
+        self._encode(out, msg)
+        return bytes(out)
+
+    def _take(self, b, pos, n):
+        if pos + n > len(b):
+            raise SerializationError('Truncated message')
+        return (b[pos:pos + n], pos + n)
+
+    def _decode(self, b, pos):
+        (tag, pos) = self._take(b, pos, 1)
+        tag = tag[0]
+        if tag == self.NONE:
+            return (None, pos)
+        if tag in (self.G1, self.G2):
+            (data, pos) = self._take(b, pos, G2_SIZE if tag == self.G2 else G1_SIZE)
+            return (self.ec_point(decompress_g2(data) if tag == self.G2 else decompress_g1(data)), pos)
+        if tag in (self.FIELD, self.INT):
+            (data, pos) = self._take(b, pos, WORD_SIZE)
+            n = int.from_bytes(data, 'big')
+            return (self.fq(n) if tag == self.FIELD else n, pos)
+        if tag in (self.BYTES, self.STR):
+            (n, pos) = self._take(b, pos, 4)
+            (data, pos) = self._take(b, pos, int.from_bytes(n, 'big'))
+            return (data.decode('utf-8') if tag == self.STR else bytes(data), pos)
+        if tag in (self.TUPLE, self.LIST):
+            (n, pos) = self._take(b, pos, 4)
+            items = []
+            for _ in range(int.from_bytes(n, 'big')):
+                (item, pos) = self._decode(b, pos)
+                items.append(item)
+            return (tuple(items) if tag == self.TUPLE else items, pos)
+        raise SerializationError(f'Unknown tag {tag}')
+
+    def decode(self, b):
+        (msg, pos) = self._decode(b, 0)
+        if pos != len(b):
+            raise SerializationError('Trailing bytes after message')
+        return msg
+
+import unittest
+from py_ecc.bn128 import G2, curve_order, multiply, is_inf
+from ec import from_ecc_py
+from utils import encoded_size
+import py_eth_pairing
+import py_eth_pairing.jacobian
+
+class TestCompression(unittest.TestCase):
+    def test_g1(self):
+        BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+        for k in [1, 2, 3, BN128FQ.rand().n]:
+            p = BN128Point.G1() * BN128FQ(k)
+            for q_ in [p, p.neg()]:
+                b = compress_g1(q_)
+                self.assertEqual(len(b), G1_SIZE)
+                self.assertEqual(BN128Point(decompress_g1(b)), q_)
+        self.assertEqual(decompress_g1(compress_g1((0, 0))), (0, 0))
+        with self.assertRaises(SerializationError):
+            decompress_g1((4).to_bytes(WORD_SIZE, 'big')) # x^3 + 3 is not a square
+        with self.assertRaises(SerializationError):
+            decompress_g1(q.to_bytes(WORD_SIZE, 'big'))
+
+    def test_g2(self):
+        BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+        p = BN128Point.G2() * BN128FQ.rand()
+        for q_ in [p, BN128Point((p.p[0], -p.p[1]))]:
+            b = compress_g2(q_)
+            self.assertEqual(len(b), G2_SIZE)
+            self.assertEqual(decompress_g2(b), q_.p)
+        self.assertIsNone(decompress_g2(compress_g2(None)))
+        self.assertEqual(sqrt_fq2(FQ2([0, 0])), FQ2([0, 0]))
+
+    def test_g2_subgroup(self):
+        self.assertTrue(is_in_g2(multiply(G2, 5)))
+        # points on the twist outside G2 agree with the multiplication by the group order
+        x = 4
+        for _ in range(3):
+            y = sqrt_fq2(FQ2([x, 1]) ** 3 + b2)
+            while y is None:
+                x += 1
+                y = sqrt_fq2(FQ2([x, 1]) ** 3 + b2)
+            p = (FQ2([x, 1]), y)
+            self.assertEqual(is_in_g2(p), is_inf(multiply(p, curve_order)))
+            self.assertFalse(is_in_g2(p))
+            with self.assertRaises(SerializationError):
+                decompress_g2(compress_g2(p))
+            x += 1
+
+    def test_serialize_compressed(self):
+        BN128JFQ, BN128JPoint = from_ecc_py('BN128J', py_eth_pairing.jacobian)
+        g1 = BN128JPoint.G1() * BN128JFQ(5)
+        g2 = BN128JPoint.G2() * BN128JFQ(5)
+        msg = [(BN128JFQ(7), g1, 'agg'), [(g1, g2)], b'xy']
+        b = serialize_compressed(*msg)
+        self.assertEqual(len(b), encoded_size(*msg, compressed=True))
+        self.assertEqual(b[WORD_SIZE:2 * WORD_SIZE], compress_g1(g1))
+        self.assertEqual(decompress_many(compress_many([g1, g1.neg()]), BN128JPoint), [g1, g1.neg()])
+
+    def test_codec(self):
+        BN128JFQ, BN128JPoint = from_ecc_py('BN128J', py_eth_pairing.jacobian)
+        codec = PointCodec(BN128JPoint, BN128JFQ)
+        g1 = BN128JPoint.G1() * BN128JFQ(5)
+        g2 = BN128JPoint.G2() * BN128JFQ(5)
+        msg = [(BN128JFQ(7), g1, 'agg'), [(g1, g2), ()], b'xy', 3, None]
+        b = codec.encode(msg)
+        self.assertEqual(codec.decode(b), msg)
+        self.assertEqual(b[b.index(compress_g1(g1)) - 1:][:1], b'G')
+        with self.assertRaises(SerializationError):
+            codec.decode(b[:-1])
+        with self.assertRaises(SerializationError):
+            codec.decode(b + b'N')
+        with self.assertRaises(ValueError):
+            codec.encode([1, -1])
@@ -6,20 +6,23 @@ from abc import ABC, abstractmethod
 from py_ecc.typing import Point2D, Field
 
 class FQ(ABC):
+    __slots__ = ('n',)
+    q: int # modulus, cached on the class by create_fq
+
     def __init__(self: Self, n: int):
         self.n = n
 
     def __add__(self: Self, other: Self) -> Self:
-        return self.__class__((self.n + other.n) % self.curve_order())
+        return self.__class__((self.n + other.n) % self.q)
 
     def __sub__(self: Self, other: Self) -> Self:
-        return self.__class__((self.n - other.n) % self.curve_order())
+        return self.__class__((self.n - other.n) % self.q)
 
     def __mul__(self: Self, other: Self) -> Self:
-        return self.__class__((self.n * other.n) % self.curve_order())
+        return self.__class__((self.n * other.n) % self.q)
 
     def __pow__(self: Self, exp: int) -> Self:
-        return self.__class__(pow(self.n, exp, self.curve_order()))
+        return self.__class__(pow(self.n, exp, self.q))
 
     def __repr__(self: Self) -> str:
         return f'{self.__class__.__name__}({self.n})'
@@ -37,16 +40,141 @@ class FQ(ABC):
 
     @classmethod
     def rand(cls):
-        return cls(randbelow(cls.curve_order()))
+        return cls(randbelow(cls.q))
 
     @classmethod
     def sum(cls, fqs: List['FQ']):
+        # reduces once at the end instead of after every addition
         assert fqs
-        return reduce(lambda a, b: a + b, fqs)
+        return cls(sum(fq.n for fq in fqs) % cls.q)
+
+    @classmethod
+    def inner_product(cls, fqs: List['FQ'], others: List['FQ']):
+        assert len(fqs) == len(others)
+        return cls(sum(a.n * b.n for (a, b) in zip(fqs, others)) % cls.q)
+
+    @classmethod
+    def vadd(cls, fqs: List['FQ'], others: List['FQ']) -> List['FQ']:
+        assert len(fqs) == len(others)
+        q = cls.q
+        return [cls((a.n + b.n) % q) for (a, b) in zip(fqs, others)]
+
+    @classmethod
+    def vmul(cls, fqs: List['FQ'], others: List['FQ']) -> List['FQ']:
+        assert len(fqs) == len(others)
+        q = cls.q
+        return [cls(a.n * b.n % q) for (a, b) in zip(fqs, others)]
+
+    @classmethod
+    def batch_inv(cls, fqs: List['FQ']) -> List['FQ']:
+        # Montgomery's trick: n inverses for one modular inversion and 3(n-1) multiplications
+        q = cls.q
+        prefix = [1]
+        for fq in fqs:
+            if fq.n % q == 0:
+                raise ZeroDivisionError('batch_inv of zero')
+            prefix.append(prefix[-1] * fq.n % q)
+
+        acc_inv = pow(prefix[-1], -1, q)
+        invs = [None] * len(fqs)
+        for i in reversed(range(len(fqs))):
+            invs[i] = cls(acc_inv * prefix[i] % q)
+            acc_inv = acc_inv * fqs[i].n % q
+        return invs
+
+def _add_or_none(add, a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return add(a, b)
+
+def _msm_window(n: int) -> int:
+    if n < 4:
+        return 1
+    return max(2, (n.bit_length() * 2) // 3)
+
+def pippenger(points: list, scalars: List[int], add, double, zero=None):
+    # bucket method: sum(scalars[i] * points[i]) with ~ (256/c) * (n + 2^c) additions
+    assert len(points) == len(scalars)
+    terms = [(p, k) for (p, k) in zip(points, scalars) if k != 0 and p != zero]
+    if not terms:
+        return zero
+
+    c = _msm_window(len(terms))
+    mask = (1 << c) - 1
+    num_bits = max(k.bit_length() for (_, k) in terms)
+    result = None
+    for shift in reversed(range(0, num_bits, c)):
+        if result is not None:
+            for _ in range(c):
+                result = double(result)
+
+        buckets = [None] * (mask + 1)
+        for (p, k) in terms:
+            digit = (k >> shift) & mask
+            if digit:
+                buckets[digit] = _add_or_none(add, buckets[digit], p)
+
+        running = None
+        window_sum = None
+        for digit in range(mask, 0, -1):
+            running = _add_or_none(add, running, buckets[digit])
+            window_sum = _add_or_none(add, window_sum, running)
+        result = _add_or_none(add, result, window_sum)
+
+    return zero if result is None else result
+
+class FixedBaseTable:
+    # windowed fixed-base table, rows[j][d] = d * 2^(window*j) * base, built on first use; with the
+    # group order, scalars are reduced first like in a generic multiplication
+    def __init__(self, base, add, double, zero=None, bits=256, window=4, add_many=None, order=None):
+        self.base = base
+        self.order = order
+        self.add = add
+        self.add_many = add_many
+        self.double = double
+        self.zero = zero
+        self.bits = bits
+        self.window = window
+        self.rows = None
+
+    def build(self):
+        rows = []
+        row_base = self.base
+        for _ in range(0, self.bits, self.window):
+            row = [None, row_base]
+            for _ in range(2, 1 << self.window):
+                row.append(self.add(row[-1], row_base))
+            rows.append(row)
+            for _ in range(self.window):
+                row_base = self.double(row_base)
+        self.rows = rows
+
+    def mul(self, k: int):
+        if self.order is not None:
+            k %= self.order
+        if not 0 <= k < (1 << self.bits):
+            raise ValueError(f'Scalar does not fit a {self.bits}-bit table')
+        if self.rows is None:
+            self.build()
+
+        mask = (1 << self.window) - 1
+        terms = []
+        for row in self.rows:
+            if k & mask:
+                terms.append(row[k & mask])
+            k >>= self.window
+        if not terms:
+            return self.zero
+        if self.add_many is not None:
+            return self.add_many(terms)
+        return reduce(self.add, terms)
 
 class ECPoint(ABC):
-    def __init__(self, p: Point2D[Field]):
+    def __init__(self, p: Point2D[Field], table: FixedBaseTable = None):
         self.p = p
+        self.table = table
 
     @classmethod
     @abstractmethod
@@ -68,6 +196,10 @@ class ECPoint(ABC):
     def __mul__(self, fq: FQ): # TODO: just int instead of FQ
         pass
 
+    @abstractmethod
+    def precompute(self, g2: bool = False) -> Self:
+        pass
+
     @abstractmethod
     def __add__(self, other: Self):
         pass
@@ -81,9 +213,24 @@ class ECPoint(ABC):
         pass
 
     @classmethod
-    def pairing(cls, p1: Self, p2: Self):
+    @abstractmethod
+    def pairing(cls, *ps: Self) -> bool:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def msm(cls, points: List[Self], fqs: List[FQ]) -> Self:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def msm_g2(cls, points: List[Self], fqs: List[FQ]) -> Self:
         pass
 
+    @classmethod
+    def mul_many(cls, points: List[Self], fqs: List[FQ]) -> List[Self]:
+        return [p * fq for (p, fq) in zip(points, fqs)]
+
     def __eq__(self, other: Self) -> bool:
         return self.normalize().p == other.normalize().p
 
@@ -94,26 +241,57 @@ class ECPoint(ABC):
 
 def create_fq(name, curve_order):
     class ThisFQ(FQ):
+        __slots__ = ()
+
         @classmethod
         def curve_order(cls) -> int:
             return curve_order
 
     ThisFQ.__name__ = name
+    ThisFQ.q = curve_order
 
     return ThisFQ
 
-def create_curve(name, fq: FQ, G1, G2, add, mul, norm, neg, pairing):
+def create_curve(name, fq: FQ, G1, G2, add, mul, norm, neg, pairing, msm, msm_g2, g1_ops, g2_ops, add_many=None, mul_many=None):
     class ThisCurve(ECPoint):
+        _G1 = None
+        _G2 = None
+
         @classmethod
         def G1(cls):
-            return cls(G1)
+            if cls._G1 is None:
+                cls._G1 = cls(G1).precompute()
+            return cls._G1
 
         @classmethod
         def G2(cls):
-            return cls(G2)
+            if cls._G2 is None:
+                cls._G2 = cls(G2).precompute(g2=True)
+            return cls._G2
 
         def __mul__(self, fq: FQ):
-            return self.__class__(mul(self.p, fq.n))
+            if self.table is not None:
+                return self.__class__(self.table.mul(fq.n))
+            return self.__class__(mul(self.p, fq.n % fq.q))
+
+        def precompute(self, g2=False):
+            (add, double, zero) = g2_ops if g2 else g1_ops
+            table = FixedBaseTable(self.p, add, double, zero, fq.curve_order().bit_length(), add_many=None if g2 else add_many, order=fq.curve_order())
+            return self.__class__(self.p, table)
+
+        @classmethod
+        def sum(cls, points):
+            assert points
+            if add_many is None:
+                return super().sum(points)
+            return cls(add_many([p.p for p in points]))
+
+        @classmethod
+        def mul_many(cls, points, fqs):
+            assert len(points) == len(fqs)
+            if mul_many is None or any(p.table is not None for p in points):
+                return super().mul_many(points, fqs)
+            return [cls(p) for p in mul_many([p.p for p in points], [fq.n for fq in fqs])]
 
         def __add__(self, other: Self):
             return self.__class__(add(self.p, other.p))
@@ -126,13 +304,38 @@ def create_curve(name, fq: FQ, G1, G2, add, mul, norm, neg, pairing):
 
         @classmethod
         def pairing(cls, *ps): # TODO: should return FQ12
+            # ps = (g1_1, g2_1, g1_2, g2_2, ...), any number of pairs share one final exponentiation
+            assert len(ps) % 2 == 0
             return pairing(*[p.p for p in ps])
 
+        @classmethod
+        def msm(cls, points, fqs):
+            return cls(msm([p.p for p in points], [fq.n for fq in fqs]))
+
+        @classmethod
+        def msm_g2(cls, points, fqs):
+            return cls(msm_g2([p.p for p in points], [fq.n for fq in fqs]))
+
     ThisCurve.__name__ = name
 
     return ThisCurve
 
 def from_ecc_py(name, module):
     ThisFQ = create_fq(f'{name}FQ', module.curve_order)
-    ThisCurve = create_curve(f'{name}Point', ThisFQ, module.G1, module.G2, module.add, module.multiply, module.normalize if hasattr(module, 'normalize') else lambda x: x, module.neg, module.pairing)
+    double = module.double if hasattr(module, 'double') else lambda p: module.add(p, p)
+    add_g2 = module.add_g2 if hasattr(module, 'add_g2') else module.add
+    double_g2 = module.double_g2 if hasattr(module, 'double_g2') else double
+    zero = module.Z1 if hasattr(module, 'Z1') else None
+    zero_g2 = module.Z2 if hasattr(module, 'Z2') else None
+    add_many = module.add_many if hasattr(module, 'add_many') else None
+    mul_many = module.multiply_many if hasattr(module, 'multiply_many') else None
+    if hasattr(module, 'msm'):
+        msm = module.msm
+    elif add_many is not None and mul_many is not None:
+        # a native backend: two bulk calls beat pippenger's one FFI crossing per bucket addition
+        msm = lambda ps, ks: add_many(mul_many(ps, ks))
+    else:
+        msm = lambda ps, ks: pippenger(ps, ks, module.add, double, zero)
+    msm_g2 = module.msm_g2 if hasattr(module, 'msm_g2') else lambda ps, ks: pippenger(ps, ks, add_g2, double_g2, zero_g2)
+    ThisCurve = create_curve(f'{name}Point', ThisFQ, module.G1, module.G2, module.add, module.multiply, module.normalize if hasattr(module, 'normalize') else lambda x: x, module.neg, module.pairing, msm, msm_g2, (module.add, double, zero), (add_g2, double_g2, zero_g2), add_many, mul_many)
     return ThisFQ, ThisCurve
@@ -5,8 +5,12 @@ from ec import from_ecc_py
 import py_eth_pairing
 from bm_bls import BM_BLS
 from bm_sb import BM_SB
+from token_store import TokenStoreWriter, SCALAR, G1, G2, COMPRESSED
 BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
 
+# the Solidity tests read the uncompressed stores, compressed copies are for off-chain consumers
+COMPRESSED_STORES = os.environ.get('COMPRESSED_STORES', '0') == '1'
+
 def write_bm_bls_aggr_fixture(apk, ms, sigmas):
     a, b = apk.p
     apk = [*a.coeffs, *b.coeffs]
@@ -19,6 +23,11 @@ def write_bm_bls_aggr_fixture(apk, ms, sigmas):
     with open('data/input_aggr.json', 'w') as f:
         json.dump(data, f)
 
+def write_bm_bls_aggr_store(apk, ms, sigmas, path='data/input_aggr.bin', flags=0):
+    with TokenStoreWriter(path, flags) as w:
+        w.section('apk', G2).append(apk)
+        w.section('tokens', SCALAR + G1).extend(zip(ms, sigmas))
+
 def write_bm_bls_aggr_hm_fixture(apk, hms, sigmas):
     hms_fmt = []
     for hm in hms:
@@ -36,6 +45,11 @@ def write_bm_bls_aggr_hm_fixture(apk, hms, sigmas):
     with open('data/input_aggr_hm.json', 'w') as f:
         json.dump(data, f)
 
+def write_bm_bls_aggr_hm_store(apk, hms, sigmas, path='data/input_aggr_hm.bin', flags=0):
+    with TokenStoreWriter(path, flags) as w:
+        w.section('apk', G2).append(apk)
+        w.section('tokens', G1 + G1).extend(zip(hms, sigmas))
+
 def write_bm_sb_fixture(pks, m, sigma):
     (R_bar, y_bar, z_bar) = sigma
     data = {
@@ -49,24 +63,36 @@ def write_bm_sb_fixture(pks, m, sigma):
     with open('data/input.json', 'w') as f:
         json.dump(data, f)
 
+def write_bm_sb_store(pks, m, sigma, path='data/input.bin', flags=0):
+    (R_bar, y_bar, z_bar) = sigma
+    with TokenStoreWriter(path, flags) as w:
+        w.section('pks', G1).extend((pk,) for pk in pks)
+        w.section('tokens', SCALAR + G1 + SCALAR + SCALAR).append(m, R_bar, y_bar, z_bar)
+
 def generate_bm_sb_fixture(num_signers):
     m = BN128FQ.rand()
     hash = lambda x: sha256(x).digest()
     max_int_size = 32
-    bm = BM_SB(BN128Point, BN128FQ, max_int_size, hash, num_signers)
+    bm = BM_SB(BN128Point, BN128FQ, max_int_size, hash, num_signers, hash_ctor=sha256)
     (sks, pks) = bm.keygen()
     sigma = bm.sign(pks, sks, m)
     assert bm.verify(pks, m, sigma)
     write_bm_sb_fixture(pks, m, sigma)
+    write_bm_sb_store(pks, m, sigma)
+    if COMPRESSED_STORES:
+        write_bm_sb_store(pks, m, sigma, 'data/input_compressed.bin', COMPRESSED)
 
 def generate_bm_bls_aggr_fixture(num_messages, num_signers):
     ms = [BN128FQ.rand() for _ in range(1, num_messages+1)]
     bm = BM_BLS(BN128Point, BN128FQ, num_signers)
     (pks, sks) = bm.keygen()
     apk = bm.keyaggr(pks)
-    sigmas = [bm.sign(sks, pks, m) for m in ms]
+    sigmas = bm.sign_many(sks, pks, ms)
     assert bm.verify_aggr(pks, ms, sigmas)
     write_bm_bls_aggr_fixture(apk, ms, sigmas)
+    write_bm_bls_aggr_store(apk, ms, sigmas)
+    if COMPRESSED_STORES:
+        write_bm_bls_aggr_store(apk, ms, sigmas, 'data/input_aggr_compressed.bin', COMPRESSED)
 
 def generate_bm_bls_aggr_hm_fixture(num_messages, num_signers):
     bm = BM_BLS(BN128Point, BN128FQ, num_signers)
@@ -76,10 +102,13 @@ def generate_bm_bls_aggr_hm_fixture(num_messages, num_signers):
 
     (pks, sks) = bm.keygen()
     apk = bm.keyaggr(pks)
-    sigmas = [bm.sign(sks, pks, m) for m in ms]
+    sigmas = bm.sign_many(sks, pks, ms)
     assert bm.verify_aggr_hm(pks, hms, sigmas)
 
     write_bm_bls_aggr_hm_fixture(apk, hms, sigmas)
+    write_bm_bls_aggr_hm_store(apk, hms, sigmas)
+    if COMPRESSED_STORES:
+        write_bm_bls_aggr_hm_store(apk, hms, sigmas, 'data/input_aggr_hm_compressed.bin', COMPRESSED)
 
 if __name__ == '__main__':
     num_messages = int(os.environ.get('NUM_MESSAGES', 1))
@@ -1,17 +1,85 @@
 from hash_to_field import Hp
+from utils import LRUCache
 from py_ecc.utils import prime_field_inv as inv
 from py_ecc.bn128 import (
     field_modulus as FIELD_MODULUS,
     FQ, add, b, neg
 )
 
+HASH_TO_POINT_CACHE_SIZE = 4096
+
+_cache = LRUCache(HASH_TO_POINT_CACHE_SIZE)
+
 def hash_to_point(msg, dst):
+    p = _cache.get((msg, dst))
+    if p is None:
+        p = _hash_to_point(msg, dst)
+        _cache.put((msg, dst), p)
+    return p
+
+def _hash_to_point(msg, dst):
     [e0], [e1] = Hp(msg, 2, dst)
     p0 = map_to_point(e0)
     p1 = map_to_point(e1)
     p = add(p0, p1)
     return p
 
+def hash_to_point_many(msgs, dst):
+    # same points as hash_to_point, with the field inversions of all messages batched; results are
+    # collected locally since the batch may be larger than the cache and evict its own entries
+    points = {}
+    missing = []
+    for msg in dict.fromkeys(msgs):
+        p = _cache.get((msg, dst))
+        if p is None:
+            missing.append(msg)
+        else:
+            points[msg] = p
+    ts = []
+    for msg in missing:
+        [e0], [e1] = Hp(msg, 2, dst)
+        ts += [FQ(e0), FQ(e1)]
+
+    nonzero = [t for t in ts if t != 0]
+    invs = batch_inv([ONE_PLUS_B + t**2 for t in nonzero] + nonzero)
+    d_invs = iter(invs[:len(nonzero)])
+    t_invs = iter(invs[len(nonzero):])
+    ps = [F0 if t == 0 else _map_to_point(t, next(d_invs), next(t_invs)) for t in ts]
+
+    for (msg, p) in zip(missing, batch_add(ps[0::2], ps[1::2])):
+        points[msg] = p
+        _cache.put((msg, dst), p)
+    return [points[msg] for msg in msgs]
+
+def batch_inv(xs):
+    # Montgomery's trick: one inversion for the whole list, xs must be non-zero
+    if not xs:
+        return []
+    prefix = [FQ.one()]
+    for x in xs:
+        prefix.append(prefix[-1] * x)
+    acc_inv = 1 / prefix[-1]
+    invs = [None] * len(xs)
+    for i in reversed(range(len(xs))):
+        invs[i] = acc_inv * prefix[i]
+        acc_inv = acc_inv * xs[i]
+    return invs
+
+def batch_add(ps, qs):
+    # affine p + q for finite points with the chord slopes inverted in one batch
+    indices = [i for i in range(len(ps)) if ps[i][0] != qs[i][0]]
+    dx_invs = batch_inv([qs[i][0] - ps[i][0] for i in indices])
+    rs = [None] * len(ps)
+    for (i, dx_inv) in zip(indices, dx_invs):
+        (x1, y1), (x2, y2) = ps[i], qs[i]
+        l = (y2 - y1) * dx_inv
+        x3 = l * l - x1 - x2
+        rs[i] = (x3, l * (x1 - x3) - y1)
+    for i in range(len(ps)):
+        if rs[i] is None:
+            rs[i] = add(ps[i], qs[i])
+    return rs
+
 def sqrt(x: FQ):
     x0 = x**((FIELD_MODULUS+1)//4)
     if (x == x0**2):
@@ -19,6 +87,12 @@ def sqrt(x: FQ):
     else:
         return FQ.zero()
 
+SQRT3 = sqrt(FQ(-3))
+SQRT3_INV = 1 / SQRT3
+ONE_PLUS_B = 1 + b
+Z0 = (SQRT3 - 1) / 2
+F0 = (Z0, sqrt(ONE_PLUS_B))
+
 def get_xy1(x_1, x_2, x_3):
     # Check x_1
     y2 = x_1**3 + b
@@ -45,19 +119,21 @@ def map_to_point(t):
     if type(t) != FQ:
         t = FQ(t)
 
-    x = sqrt(t)
-    decision = x*x == t # TODO: check
-
-    sqrt3 = sqrt(FQ(-3))
-    F0 = ((sqrt3-1)/2, sqrt(1+b))
-
     if t == 0:
         return F0 # TODO: check
 
-    w = sqrt3*t/(1+b+t**2)
-    x_1 = (sqrt3-1)/2 - t*w
+    return _map_to_point(t, 1 / (ONE_PLUS_B + t**2), 1 / t)
+
+def _map_to_point(t, d_inv, t_inv):
+    # d_inv = 1/(1+b+t^2), t_inv = 1/t
+    x = sqrt(t)
+    decision = x*x == t # TODO: check
+
+    w = SQRT3*t*d_inv
+    x_1 = Z0 - t*w
     x_2 = -x_1 - 1
-    x_3 = 1 + 1 / w**2
+    w_inv = (ONE_PLUS_B + t**2) * SQRT3_INV * t_inv
+    x_3 = 1 + w_inv**2
 
     T = get_xy1(x_1, x_2, x_3)
 
@@ -0,0 +1,255 @@
+import sys
+import json
+import time
+import inspect
+import threading
+from collections import defaultdict
+from ec import ECPoint, FQ
+import utils
+import hash_to_point
+from bm_bls import BM_BLS
+from bm_sb import BM_SB
+
+# Opt-in operation counts and latencies. While an Instrumentation context is active the curve,
+# field, hashing and serialization entry points and the protocol phases are monkeypatched with
+# recording wrappers; the originals are put back on exit, so nothing is paid when it isn't.
+# Every call is recorded under the innermost active (phase, round) of its thread, where round is
+# the number of messages a round-based phase (a U/S generator) has received so far and 0 for plain
+# methods. Times are inclusive: e.g. serialize inside a hash is counted on its own as well.
+PHASES = [
+    'U', 'S', 'U_many', 'S_many',
+    'U_sign', 'S_sign', 'U_sign_many', 'S_sign_many',
+    'verify', 'verify_batch', 'verify_aggr', 'verify_aggr_multi', 'verify_aggr_hm',
+]
+SCHEMES = [BM_BLS, BM_SB]
+
+# attribute -> (op name or function of the call arguments, items processed or None)
+EC_OPS = {
+    '__add__': ('ec.add', None),
+    '__mul__': (lambda p, k: 'ec.mul_fixed' if p.table is not None else 'ec.mul', None),
+    'msm': ('ec.msm', lambda cls, points, fqs: len(points)),
+    'msm_g2': ('ec.msm_g2', lambda cls, points, fqs: len(points)),
+    'sum': ('ec.sum', lambda cls, points: len(points)),
+    'mul_many': ('ec.mul_many', lambda cls, points, fqs: len(points)),
+    'pairing': ('pairing', lambda cls, *ps: len(ps) // 2),
+}
+FQ_OPS = {
+    '__mul__': ('fq.mul', None),
+    '__pow__': (lambda x, e: 'fq.inv' if e < 0 else 'fq.pow', None),
+    'inner_product': ('fq.inner_product', lambda cls, fqs, others: len(fqs)),
+    'batch_inv': ('fq.batch_inv', lambda cls, fqs: len(fqs)),
+}
+HASH_OPS = {'_H': ('hash', None)}
+TRANSCRIPT_OPS = {'digest': ('hash', None)}
+# module level functions, patched in every module that imported them by name
+FUNCTIONS = [
+    (hash_to_point, 'hash_to_point', 'hash_to_point', None),
+    (hash_to_point, 'hash_to_point_many', 'hash_to_point_many', lambda msgs, dst: len(msgs)),
+    (utils, 'serialize', 'serialize', None), # items are the bytes written, see _wrap_serialize
+]
+
+def _subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _subclasses(sub)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+class Instrumentation:
+    _active = None
+
+    def __init__(self):
+        self.ops = defaultdict(lambda: [0, 0, 0]) # (phase, round, op) -> [calls, ns, items]
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.patches = []
+
+    def _stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def record(self, op, ns, items=0):
+        stack = self._stack()
+        (phase, round) = stack[-1] if stack else ('', 0)
+        with self.lock:
+            entry = self.ops[(phase, round, op)]
+            entry[0] += 1
+            entry[1] += ns
+            entry[2] += items
+
+    def _wrap_op(self, f, op, items):
+        record = self.record
+        def wrapper(*args):
+            start = time.perf_counter_ns()
+            result = f(*args)
+            ns = time.perf_counter_ns() - start
+            record(op(*args) if callable(op) else op, ns, items(*args) if items is not None else 0)
+            return result
+        return wrapper
+
+    def _wrap_serialize(self, f):
+        record = self.record
+        def wrapper(*args):
+            start = time.perf_counter_ns()
+            result = f(*args)
+            record('serialize', time.perf_counter_ns() - start, len(result))
+            return result
+        return wrapper
+
+    def _wrap_phase(self, f, phase):
+        stack = self._stack
+        record = self.record
+        def run(round, call):
+            stack().append((phase, round))
+            start = time.perf_counter_ns()
+            try:
+                return call()
+            finally:
+                record('total', time.perf_counter_ns() - start)
+                stack().pop()
+
+        if not inspect.isgeneratorfunction(f):
+            return lambda *args, **kwargs: run(0, lambda: f(*args, **kwargs))
+
+        def generator(*args, **kwargs):
+            gen = f(*args, **kwargs)
+            (round, value) = (0, None)
+            while True:
+                try:
+                    out = run(round, lambda: gen.send(value))
+                except StopIteration as stop:
+                    return stop.value
+                value = yield out
+                round += 1
+        return generator
+
+    def _patch_class(self, cls, name, wrap):
+        original = cls.__dict__[name]
+        if isinstance(original, classmethod):
+            patched = classmethod(wrap(original.__func__))
+        else:
+            patched = wrap(original)
+        self.patches.append((cls, name, original))
+        setattr(cls, name, patched)
+
+    def _patch_ops(self, classes, ops):
+        for cls in classes:
+            for (name, (op, items)) in ops.items():
+                if name in cls.__dict__:
+                    self._patch_class(cls, name, lambda f: self._wrap_op(f, op, items))
+
+    def _patch_function(self, module, name, op, items):
+        original = getattr(module, name)
+        patched = self._wrap_serialize(original) if op == 'serialize' else self._wrap_op(original, op, items)
+        for mod in list(sys.modules.values()):
+            namespace = getattr(mod, '__dict__', None)
+            if namespace is None:
+                continue
+            for (key, value) in list(namespace.items()):
+                if value is original:
+                    self.patches.append((mod, key, original))
+                    setattr(mod, key, patched)
+
+    def __enter__(self):
+        if Instrumentation._active is not None:
+            raise RuntimeError('Instrumentation is already active')
+        Instrumentation._active = self
+        self._patch_ops(_subclasses(ECPoint), EC_OPS)
+        self._patch_ops([FQ], FQ_OPS)
+        self._patch_ops(SCHEMES, HASH_OPS)
+        self._patch_ops([utils.Transcript], TRANSCRIPT_OPS)
+        for (module, name, op, items) in FUNCTIONS:
+            self._patch_function(module, name, op, items)
+        for cls in SCHEMES:
+            for phase in PHASES:
+                if phase in cls.__dict__:
+                    self._patch_class(cls, phase, lambda f: self._wrap_phase(f, phase))
+        return self
+
+    def __exit__(self, *exc):
+        for (owner, name, original) in reversed(self.patches):
+            setattr(owner, name, original)
+        self.patches = []
+        Instrumentation._active = None
+
+    def rows(self):
+        with self.lock:
+            ops = sorted(self.ops.items())
+        return [
+            {'phase': phase, 'round': round, 'op': op, 'calls': calls, 'seconds': ns / 1e9, 'items': items}
+            for ((phase, round, op), (calls, ns, items)) in ops
+        ]
+
+    def calls(self, op, phase=None):
+        return sum(row['calls'] for row in self.rows() if row['op'] == op and phase in (None, row['phase']))
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps({'ops': self.rows()}, **kwargs)
+
+    def to_prometheus(self, prefix='bm') -> str:
+        metrics = [
+            ('calls', 'Calls of instrumented operations.', lambda row: row['calls']),
+            ('seconds', 'Time spent in instrumented operations.', lambda row: row['seconds']),
+            ('items', 'Terms, pairs, messages or bytes processed by instrumented operations.', lambda row: row['items']),
+        ]
+        rows = self.rows()
+        lines = []
+        for (name, help, value) in metrics:
+            metric = f'{prefix}_op_{name}_total'
+            lines += [f'# HELP {metric} {help}', f'# TYPE {metric} counter']
+            for row in rows:
+                labels = ','.join(f'{key}="{_escape(row[key])}"' for key in ('phase', 'round', 'op'))
+                lines.append(f'{metric}{{{labels}}} {value(row)}')
+        return '\n'.join(lines) + '\n'
+
+import unittest
+from hashlib import sha256
+from ec import from_ecc_py
+import py_eth_pairing
+import bm_bls
+
+class TestInstrumentation(unittest.TestCase):
+    def test_bm_sb(self):
+        BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+        bm = BM_SB(BN128Point, BN128FQ, 32, lambda x: sha256(x).digest(), 2, hash_ctor=sha256)
+        (sks, pks) = bm.keygen()
+        m = BN128FQ.rand()
+        with Instrumentation() as stats:
+            sigma = bm.sign(pks, sks, m)
+            self.assertTrue(bm.verify(pks, m, sigma))
+
+        self.assertEqual(stats.calls('total', 'U_sign'), 4) # initial step and three replies
+        self.assertEqual(stats.calls('total', 'S_sign'), 2 * 4)
+        self.assertEqual(stats.calls('total', 'verify'), 2) # U_sign checks the token it unblinded
+        self.assertGreater(stats.calls('ec.mul_fixed', 'S_sign'), 0)
+        self.assertGreater(stats.calls('ec.msm', 'U_sign'), 0)
+        self.assertGreater(stats.calls('ec.msm', 'verify'), 0)
+        self.assertGreater(stats.calls('hash', 'verify'), 0)
+        self.assertTrue(any(row['op'] == 'serialize' and row['items'] > 0 for row in stats.rows()))
+        self.assertTrue(any(row['phase'] == 'S_sign' and row['round'] == 3 for row in stats.rows()))
+        self.assertEqual(json.loads(stats.to_json())['ops'], stats.rows())
+        self.assertIn('bm_op_calls_total{phase="verify",round="0",op="total"} 2\n', stats.to_prometheus())
+
+    def test_bm_bls(self):
+        BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+        bm = BM_BLS(BN128Point, BN128FQ, 2)
+        (pks, sks) = bm.keygen()
+        m = BN128FQ.rand()
+        sigma = bm.sign(sks, pks, m)
+        with Instrumentation() as stats:
+            self.assertTrue(bm.verify(pks, m, sigma))
+        self.assertEqual(stats.calls('pairing', 'verify'), 1)
+        self.assertEqual(stats.calls('hash_to_point', 'verify'), 1)
+
+    def test_restore(self):
+        BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+        before = (BN128Point.__dict__['__add__'], BN128Point.__dict__['msm'], FQ.__dict__['__mul__'], BM_SB.__dict__['U_sign'], utils.serialize, bm_bls.serialize, bm_bls.hash_to_point)
+        with Instrumentation():
+            self.assertIsNot(bm_bls.hash_to_point, before[-1])
+            with self.assertRaises(RuntimeError):
+                Instrumentation().__enter__()
+        after = (BN128Point.__dict__['__add__'], BN128Point.__dict__['msm'], FQ.__dict__['__mul__'], BM_SB.__dict__['U_sign'], utils.serialize, bm_bls.serialize, bm_bls.hash_to_point)
+        self.assertTrue(all(a is b for (a, b) in zip(before, after)))
@@ -0,0 +1,201 @@
+import os
+import zlib
+import threading
+from hashlib import sha256
+from utils import serialize
+
+DIGEST_SIZE = 32 # bytes, one record per redeemed token
+
+def token_digest(m) -> bytes:
+    return sha256(serialize(m)).digest()
+
+class BloomFilter:
+    def __init__(self, num_bits=1 << 24, num_hashes=7):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray((num_bits + 7) // 8)
+
+    def _positions(self, digest: bytes):
+        # digests are uniform, so two 64-bit slices give the double-hashing family h1 + j*h2
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + j * h2) % self.num_bits for j in range(self.num_hashes)]
+
+    def add(self, digest: bytes):
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+class MemoryStore:
+    def __init__(self):
+        self.digests = set()
+
+    def add(self, digest: bytes):
+        self.digests.add(digest)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self.digests
+
+    def __iter__(self):
+        return iter(self.digests)
+
+    def __len__(self):
+        return len(self.digests)
+
+class FileStore:
+    # append-only log of digests, each record followed by its CRC-32 and fsynced before add returns,
+    # so a redemption that was acknowledged survives a crash. The log is the only source of truth:
+    # the index is rebuilt from it on open, and a torn final record (a crash mid-write) is cut off
+    MAGIC = b'BMRL\x01'
+    RECORD_SIZE = DIGEST_SIZE + 4
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        self.f = open(path, 'a+b')
+        self.f.seek(0)
+        magic = self.f.read(len(self.MAGIC))
+        if magic != self.MAGIC:
+            if not self.MAGIC.startswith(magic): # an empty file or a torn header is new
+                self.f.close()
+                raise ValueError(f'{path} is not a redemption ledger')
+            self.f.truncate(0)
+            self.f.write(self.MAGIC)
+            self._sync()
+        self.digests = set()
+        self._load()
+
+    def _sync(self):
+        self.f.flush()
+        if self.sync:
+            os.fsync(self.f.fileno())
+
+    def _load(self):
+        end = len(self.MAGIC)
+        while True:
+            record = self.f.read(self.RECORD_SIZE)
+            if len(record) == self.RECORD_SIZE and zlib.crc32(record[:DIGEST_SIZE]).to_bytes(4, 'big') == record[DIGEST_SIZE:]:
+                self.digests.add(record[:DIGEST_SIZE])
+                end += self.RECORD_SIZE
+                continue
+            if self.f.read(1): # a bad record with more after it is corruption, not a torn write
+                self.f.close()
+                raise ValueError(f'{self.path} is corrupt at offset {end}')
+            break
+        if end != self.f.tell():
+            self.f.truncate(end)
+            self._sync()
+
+    def add(self, digest: bytes):
+        assert len(digest) == DIGEST_SIZE
+        if digest in self.digests:
+            return
+        self.f.write(digest + zlib.crc32(digest).to_bytes(4, 'big'))
+        self._sync()
+        self.digests.add(digest)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self.digests
+
+    def __iter__(self):
+        return iter(self.digests)
+
+    def __len__(self):
+        return len(self.digests)
+
+    def close(self):
+        self.f.close()
+
+class RedemptionLedger:
+    # exact store of spent token digests with an optional bloom filter answering most fresh tokens
+    # without touching the store; the filter is rebuilt from the store on startup. The lock makes
+    # the check and the insert of spend one step, so concurrent redemptions of a token can't both win
+    def __init__(self, store=None, bloom: BloomFilter = None):
+        self.store = store if store is not None else MemoryStore()
+        self.bloom = bloom
+        self.lock = threading.Lock()
+        if self.bloom is not None:
+            for digest in self.store:
+                self.bloom.add(digest)
+
+    def is_spent(self, m) -> bool:
+        digest = token_digest(m)
+        with self.lock:
+            if self.bloom is not None and digest not in self.bloom:
+                return False
+            return digest in self.store
+
+    def spend(self, m) -> bool:
+        # marks m as redeemed, False if it already was
+        digest = token_digest(m)
+        with self.lock:
+            if (self.bloom is None or digest in self.bloom) and digest in self.store:
+                return False
+            self.store.add(digest)
+            if self.bloom is not None:
+                self.bloom.add(digest)
+            return True
+
+import unittest
+import tempfile
+
+class TestRedemptionLedger(unittest.TestCase):
+    def test_memory(self):
+        ledger = RedemptionLedger(bloom=BloomFilter(1 << 10))
+        self.assertFalse(ledger.is_spent(1))
+        self.assertTrue(ledger.spend(1))
+        self.assertTrue(ledger.is_spent(1))
+        self.assertFalse(ledger.spend(1))
+        self.assertTrue(ledger.spend(2))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'spent.bin')
+            store = FileStore(path)
+            ledger = RedemptionLedger(store, BloomFilter(1 << 10))
+            for m in range(100):
+                self.assertTrue(ledger.spend(m))
+            self.assertFalse(ledger.spend(42))
+            store.close()
+            self.assertEqual(os.path.getsize(path), len(FileStore.MAGIC) + 100 * FileStore.RECORD_SIZE)
+
+            with open(path, 'ab') as f:
+                f.write(token_digest(100)[:20]) # torn record
+            store = FileStore(path)
+            ledger = RedemptionLedger(store, BloomFilter(1 << 10))
+            self.assertEqual(len(store), 100)
+            self.assertEqual(sorted(store), sorted(token_digest(m) for m in range(100)))
+            self.assertTrue(all(ledger.is_spent(m) for m in range(100)))
+            self.assertFalse(ledger.is_spent(100))
+            self.assertFalse(ledger.spend(7))
+            self.assertTrue(ledger.spend(100))
+            store.close()
+            store = FileStore(path, sync=False)
+            self.assertEqual(len(store), 101)
+            store.close()
+
+            with open(path, 'r+b') as f:
+                f.seek(len(FileStore.MAGIC) + 3)
+                f.write(b'X')
+            with self.assertRaises(ValueError):
+                FileStore(path)
+            with open(path, 'r+b') as f:
+                f.write(b'XXXX')
+            with self.assertRaises(ValueError):
+                FileStore(path)
+
+    def test_concurrent_spend(self):
+        ledger = RedemptionLedger()
+        barrier = threading.Barrier(8)
+        wins = []
+        def spend():
+            barrier.wait()
+            wins.append(ledger.spend(1))
+        threads = [threading.Thread(target=spend) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(wins), [False] * 7 + [True])
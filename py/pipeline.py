@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import argparse
+from hashlib import sha256
+from concurrent.futures import ProcessPoolExecutor
+from ec import from_ecc_py
+import py_eth_pairing
+from bm_bls import BM_BLS
+from bm_sb import BM_SB
+from token_store import TokenStoreWriter, encode_field, SCALAR, G1, G2, COMPRESSED
+from utils import LRUCache
+BN128FQ, BN128Point = from_ecc_py('BN128', py_eth_pairing)
+
+# Streaming token generation: keygen -> sign -> verify -> write. Tokens are produced in chunks of
+# chunk_size, chunks are sharded over worker processes and written to a token store as they
+# complete, so memory is bounded by the chunks in flight rather than by the corpus size.
+# Workers only exchange ints and encoded bytes with the parent since the curve classes are
+# created dynamically and can't be pickled.
+
+BLS_FIELDS = SCALAR + G1
+SB_FIELDS = SCALAR + G1 + SCALAR + SCALAR
+
+# a worker process may serve several committees over its lifetime, the least recently used is dropped
+SCHEME_CACHE_SIZE = 4
+_schemes = LRUCache(SCHEME_CACHE_SIZE)
+
+def _scheme(name, sks):
+    # per-process (scheme, sks, pks), built once so fixed-base tables and committee caches are reused
+    key = (name, tuple(sks))
+    scheme = _schemes.get(key)
+    if scheme is None:
+        sks = [BN128FQ(sk) for sk in sks]
+        if name == 'bls':
+            bm = BM_BLS(BN128Point, BN128FQ, len(sks))
+            pks = [(bm.g1 * sk, bm.g2 * sk) for sk in sks]
+        else:
+            bm = BM_SB(BN128Point, BN128FQ, 32, lambda x: sha256(x).digest(), len(sks), hash_ctor=sha256)
+            pks = [bm.g * sk for sk in sks]
+        scheme = (bm, sks, pks)
+        _schemes.put(key, scheme)
+    return scheme
+
+def sign_chunk(name, sks, size, compressed=False):
+    bm, sks, pks = _scheme(name, sks)
+    ms = [BN128FQ.rand() for _ in range(size)]
+    if name == 'bls':
+        sigmas = bm.sign_many(sks, pks, ms)
+        records = [(m, sigma) for (m, sigma) in zip(ms, sigmas)]
+    else:
+        sigmas = bm.sign_many(pks, sks, ms)
+        records = [(m, *sigma) for (m, sigma) in zip(ms, sigmas)]
+
+    failed = bm.verify_batch(pks, list(zip(ms, sigmas)))
+    assert not failed, f'tokens {failed} failed verification'
+
+    fields = BLS_FIELDS if name == 'bls' else SB_FIELDS
+    return b''.join(encode_field(field, x, compressed) for record in records for (field, x) in zip(fields, record))
+
+def chunk_sizes(num_tokens, chunk_size):
+    for start in range(0, num_tokens, chunk_size):
+        yield min(chunk_size, num_tokens - start)
+
+class Progress:
+    def __init__(self, total, interval=1.0, out=sys.stderr):
+        self.total = total
+        self.done = 0
+        self.interval = interval
+        self.out = out
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def update(self, n):
+        self.done += n
+        now = time.perf_counter()
+        if now - self.last >= self.interval or self.done == self.total:
+            self.last = now
+            self.report(now)
+
+    def rate(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def report(self, now=None):
+        print(f'{self.done}/{self.total} tokens ({100 * self.done / max(self.total, 1):.1f}%), {self.rate(now):.1f} tokens/s', file=self.out)
+
+def generate_chunks(name, sks, num_tokens, chunk_size=256, workers=None, compressed=False):
+    # lazily yields (size, encoded records) for num_tokens tokens in order, signed in-process when
+    # workers == 0 and otherwise by a pool of worker processes (all cores by default)
+    sizes = chunk_sizes(num_tokens, chunk_size)
+    if workers == 0:
+        for size in sizes:
+            yield (size, sign_chunk(name, sks, size, compressed))
+        return
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        # bounded number of chunks in flight keeps memory flat for arbitrarily large corpora
+        in_flight = []
+        max_in_flight = 2 * workers
+        for size in sizes:
+            in_flight.append((size, executor.submit(sign_chunk, name, sks, size, compressed)))
+            if len(in_flight) >= max_in_flight:
+                (size_done, future) = in_flight.pop(0)
+                yield (size_done, future.result())
+        for (size_done, future) in in_flight:
+            yield (size_done, future.result())
+
+def generate(name, path, num_tokens, num_signers, chunk_size=256, workers=None, progress=None, compressed=False):
+    # name is 'bls' or 'sb'; returns the number of tokens written
+    if name not in ('bls', 'sb'):
+        raise ValueError(f'Unknown scheme {name!r}')
+    sks = [BN128FQ.rand().n for _ in range(num_signers)]
+    bm, _, pks = _scheme(name, sks)
+    progress = progress or Progress(num_tokens)
+
+    with TokenStoreWriter(path, flags=COMPRESSED if compressed else 0) as w:
+        if name == 'bls':
+            w.section('apk', G2).append(bm.keyaggr(pks))
+            w.section('tokens', BLS_FIELDS)
+        else:
+            w.section('pks', G1).extend((pk,) for pk in pks)
+            w.section('tokens', SB_FIELDS)
+
+        for (size, data) in generate_chunks(name, sks, num_tokens, chunk_size, workers, compressed):
+            w.append_raw(data, size)
+            progress.update(size)
+
+    return progress.done
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a token corpus into a binary token store')
+    parser.add_argument('scheme', choices=['bls', 'sb'])
+    parser.add_argument('out')
+    parser.add_argument('--tokens', type=int, default=int(os.environ.get('NUM_MESSAGES', 1)))
+    parser.add_argument('--signers', type=int, default=int(os.environ.get('NUM_SIGNERS', 1)))
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, 0 to run in-process')
+    parser.add_argument('--compressed', action='store_true', help='store compressed points')
+    args = parser.parse_args(argv)
+
+    progress = Progress(args.tokens)
+    generate(args.scheme, args.out, args.tokens, args.signers, args.chunk_size, args.workers, progress, args.compressed)
+    progress.report()
+
+import io
+import unittest
+import tempfile
+from token_store import TokenStore
+
+class TestPipeline(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as d:
+            for (workers, compressed) in [(0, False), (2, False), (0, True)]:
+                path = os.path.join(d, f'sb_{workers}_{compressed}.bin')
+                progress = Progress(5, out=io.StringIO())
+                self.assertEqual(generate('sb', path, 5, 2, chunk_size=2, workers=workers, progress=progress, compressed=compressed), 5)
+                with TokenStore(path, BN128Point, BN128FQ) as store:
+                    pks = list(store['pks'])
+                    tokens = list(store['tokens'])
+                    self.assertEqual(len(tokens), 5)
+                    bm = BM_SB(BN128Point, BN128FQ, 32, lambda x: sha256(x).digest(), len(pks), hash_ctor=sha256)
+                    self.assertEqual(bm.verify_batch(pks, [(m, (R_bar, y_bar, z_bar)) for (m, R_bar, y_bar, z_bar) in tokens]), [])
+
+    def test_generate_chunks(self):
+        sks = [BN128FQ.rand().n for _ in range(2)]
+        chunks = generate_chunks('bls', sks, 5, chunk_size=2, workers=0)
+        self.assertEqual(next(chunks)[0], 2) # signs one chunk at a time
+        self.assertEqual([size for (size, _) in chunks], [2, 1])
+        for name in ['bls', 'sb', 'bls', 'sb', 'bls']:
+            _scheme(name, [BN128FQ.rand().n])
+        self.assertEqual(len(_schemes), SCHEME_CACHE_SIZE)
+
+if __name__ == '__main__':
+    main()
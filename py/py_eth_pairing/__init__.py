@@ -1,5 +1,8 @@
 import eth_pairing_py
-from py_ecc.bn128 import G1, G2, neg, curve_order
+from py_ecc.bn128 import G1, G2, neg, curve_order, Z2
+from py_ecc.bn128 import add as add_g2, double as double_g2, multiply as multiply_g2
+
+Z1 = (0, 0)
 
 bar = (2**128)
 # G2[0].coeffs = (11559732032986387107991004021392285783925812861821192530917403151452391805634, 4082367875863433681332203403145435568316851327593401208105741076214120093531)
@@ -34,15 +37,37 @@ def multiply(pt, sc):
   c = lst_to_pt(lst_c)
   return c
 
-def pairing(g1_1, g2_1, g1_2, g2_2):
-  g1_pts = [g1_1, g1_2]
-  g2_pts = [g2_1, g2_2]
-  n = 2
-  lst_input = []
-  for i in range(n):
-    lst_input += fq_to_lst(g1_pts[i][0]) + fq_to_lst(g1_pts[i][1])
-    lst_input += fq_to_lst(g2_pts[i][0].coeffs[1]) + fq_to_lst(g2_pts[i][0].coeffs[0])
-    lst_input += fq_to_lst(g2_pts[i][1].coeffs[1]) + fq_to_lst(g2_pts[i][1].coeffs[0])
-  c = eth_pairing_py.pairing2(lst_input)
-  # c = lst_to_int(lst_c)
-  return c
+def pt_to_bytes(pt):
+  return int(pt[0]).to_bytes(32, 'big') + int(pt[1]).to_bytes(32, 'big')
+
+def pts_to_bytes(pts):
+  return b''.join(map(pt_to_bytes, pts))
+
+def scs_to_bytes(scs):
+  return b''.join(int(sc).to_bytes(32, 'big') for sc in scs)
+
+def bytes_to_pt(b, offset=0):
+  return (int.from_bytes(b[offset:offset+32], 'big'), int.from_bytes(b[offset+32:offset+64], 'big'))
+
+def bytes_to_pts(b):
+  return [bytes_to_pt(b, offset) for offset in range(0, len(b), 64)]
+
+def add_many(pts):
+  return bytes_to_pt(eth_pairing_py.curve_add_many(pts_to_bytes(pts)))
+
+def multiply_many(pts, scs):
+  assert len(pts) == len(scs)
+  return bytes_to_pts(eth_pairing_py.curve_mul_many(pts_to_bytes(pts), scs_to_bytes(scs)))
+
+def g2_to_bytes(pt):
+  return b''.join(int(c).to_bytes(32, 'big') for c in (pt[0].coeffs[1], pt[0].coeffs[0], pt[1].coeffs[1], pt[1].coeffs[0]))
+
+def pairing(*pts):
+  # pts = (g1_1, g2_1, g1_2, g2_2, ...), checks prod e(g1_i, g2_i) == 1
+  assert len(pts) % 2 == 0
+  lst_input = b''
+  for (g1, g2) in zip(pts[::2], pts[1::2]):
+    if g2 is None or (int(g1[0]) == 0 and int(g1[1]) == 0):
+      continue
+    lst_input += pt_to_bytes(g1) + g2_to_bytes(g2)
+  return eth_pairing_py.pairing_n(lst_input)
@@ -0,0 +1,114 @@
+import py_eth_pairing
+from py_eth_pairing import G2, curve_order, Z2, add_g2, double_g2, multiply_g2
+
+# G1 points are kept in Jacobian coordinates (X, Y, Z) ~ (X/Z^2, Y/Z^3) so that chains of
+# additions stay in Python ints; affine form is only produced by normalize (serialize, __eq__,
+# pairing) and when handing points to the native multiplication. Affine inputs (e.g. from
+# hash_to_point) are lifted on the fly.
+q = 21888242871839275222246405745257275088696311157297823662689037894645226208583
+
+G1 = (1, 2, 1)
+Z1 = (1, 1, 0)
+
+def is_inf(pt):
+  return pt[2] == 0
+
+def from_affine(pt):
+  if len(pt) == 3:
+    return pt
+  if pt[0] == 0 and pt[1] == 0:
+    return Z1
+  return (int(pt[0]), int(pt[1]), 1)
+
+def normalize(pt):
+  if len(pt) == 2:
+    return pt
+  if is_inf(pt):
+    return (0, 0)
+  if pt[2] == 1:
+    return (pt[0], pt[1])
+  z_inv = pow(pt[2], -1, q)
+  z_inv_sq = z_inv * z_inv % q
+  return (pt[0] * z_inv_sq % q, pt[1] * z_inv_sq * z_inv % q)
+
+def normalize_many(pts):
+  # Montgomery batch inversion, one modular inverse for the whole list
+  zs = [pt[2] for pt in pts if not is_inf(pt)]
+  prefix = [1]
+  for z in zs:
+    prefix.append(prefix[-1] * z % q)
+  acc_inv = pow(prefix[-1], -1, q)
+  z_invs = [None] * len(zs)
+  for i in reversed(range(len(zs))):
+    z_invs[i] = acc_inv * prefix[i] % q
+    acc_inv = acc_inv * zs[i] % q
+
+  result = []
+  z_invs = iter(z_invs)
+  for pt in pts:
+    if is_inf(pt):
+      result.append((0, 0))
+      continue
+    z_inv = next(z_invs)
+    z_inv_sq = z_inv * z_inv % q
+    result.append((pt[0] * z_inv_sq % q, pt[1] * z_inv_sq * z_inv % q))
+  return result
+
+def neg(pt):
+  pt = from_affine(pt)
+  return (pt[0], (q - pt[1]) % q, pt[2])
+
+# dbl-2009-l, a = 0
+def double(pt):
+  (X1, Y1, Z1_) = from_affine(pt)
+  if Z1_ == 0 or Y1 == 0:
+    return Z1
+  A = X1 * X1 % q
+  B = Y1 * Y1 % q
+  C = B * B % q
+  D = 2 * ((X1 + B) * (X1 + B) - A - C) % q
+  E = 3 * A % q
+  F = E * E % q
+  X3 = (F - 2 * D) % q
+  Y3 = (E * (D - X3) - 8 * C) % q
+  Z3 = 2 * Y1 * Z1_ % q
+  return (X3, Y3, Z3)
+
+# add-2007-bl
+def add(a, b):
+  a = from_affine(a)
+  b = from_affine(b)
+  if is_inf(a):
+    return b
+  if is_inf(b):
+    return a
+  (X1, Y1, Z1_) = a
+  (X2, Y2, Z2_) = b
+  Z1Z1 = Z1_ * Z1_ % q
+  Z2Z2 = Z2_ * Z2_ % q
+  U1 = X1 * Z2Z2 % q
+  U2 = X2 * Z1Z1 % q
+  S1 = Y1 * Z2_ * Z2Z2 % q
+  S2 = Y2 * Z1_ * Z1Z1 % q
+  if U1 == U2:
+    if S1 == S2:
+      return double(a)
+    return Z1
+  H = (U2 - U1) % q
+  I = 4 * H * H % q
+  J = H * I % q
+  r = 2 * (S2 - S1) % q
+  V = U1 * I % q
+  X3 = (r * r - J - 2 * V) % q
+  Y3 = (r * (V - X3) - 2 * S1 * J) % q
+  Z3 = ((Z1_ + Z2_) * (Z1_ + Z2_) - Z1Z1 - Z2Z2) * H % q
+  return (X3, Y3, Z3)
+
+def multiply(pt, sc):
+  pt = from_affine(pt)
+  if is_inf(pt):
+    return Z1
+  return from_affine(py_eth_pairing.multiply(normalize(pt), sc))
+
+def pairing(*pts):
+  return py_eth_pairing.pairing(*[normalize(pt) if len(pt) == 3 else pt for pt in pts])
@@ -3,9 +3,16 @@ extern crate eth_pairings;
 use eth_pairings::public_interface::eip196::EIP196Executor;
 
 // use pyo3::types::PyInt;
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
+use pyo3::types::PyBytes;
 use pyo3::wrap_pyfunction;
 
+// packed encodings: 32-byte big-endian words, G1 = x || y, G2 = x_im || x_re || y_im || y_re
+const SZ_WORD: usize = 32;
+const SZ_G1: usize = 2*SZ_WORD;
+const SZ_PAIR: usize = 6*SZ_WORD;
+
 fn put_u8(input: &[u128]) -> [u8; 32] {
     let mut res: [u8; 32] = [0; 32];
     let n_elem = 128/8;
@@ -61,7 +68,11 @@ fn curve_add(a: Vec<u128>, b: Vec<u128>) -> Vec<u128> {
 }
 
 #[pyfunction]
-fn curve_mul(pt: Vec<u128>, sc: Vec<u128>) -> Vec<u128> {
+fn curve_mul(py: Python<'_>, pt: Vec<u128>, sc: Vec<u128>) -> Vec<u128> {
+    py.allow_threads(|| curve_mul_impl(pt, sc))
+}
+
+fn curve_mul_impl(pt: Vec<u128>, sc: Vec<u128>) -> Vec<u128> {
     const SZ_INPUT: usize = 256*(2+1)/8;
     const SZ_U8: usize = 256/8;
     const SZ_U128: usize = 256/128;
@@ -86,7 +97,11 @@ fn curve_mul(pt: Vec<u128>, sc: Vec<u128>) -> Vec<u128> {
 }
 
 #[pyfunction]
-fn pairing2(pts: Vec<u128>) -> bool {
+fn pairing2(py: Python<'_>, pts: Vec<u128>) -> bool {
+    py.allow_threads(|| pairing2_impl(pts))
+}
+
+fn pairing2_impl(pts: Vec<u128>) -> bool {
     // const N_INT256: usize = 6*2;
     const N_INT256: usize = 6*2;
     const SZ_INPUT: usize = 256*(N_INT256)/8;
@@ -108,6 +123,79 @@ fn pairing2(pts: Vec<u128>) -> bool {
     // return output;
 }
 
+fn to_py_err<E: std::fmt::Debug>(err: E) -> PyErr {
+    PyValueError::new_err(format!("{:?}", err))
+}
+
+fn check_len(len: usize, chunk: usize) -> PyResult<usize> {
+    if len % chunk != 0 {
+        return Err(PyValueError::new_err(format!("input length {} is not a multiple of {}", len, chunk)));
+    }
+    Ok(len / chunk)
+}
+
+fn g1_add(a: &[u8], b: &[u8]) -> PyResult<[u8; SZ_G1]> {
+    let mut input = [0u8; 2*SZ_G1];
+    input[..SZ_G1].copy_from_slice(a);
+    input[SZ_G1..].copy_from_slice(b);
+    let eip_result = EIP196Executor::add(&input).map_err(to_py_err)?;
+    let mut output = [0u8; SZ_G1];
+    output.copy_from_slice(&eip_result[..SZ_G1]);
+    Ok(output)
+}
+
+fn g1_mul(pt: &[u8], sc: &[u8]) -> PyResult<[u8; SZ_G1]> {
+    let mut input = [0u8; SZ_G1 + SZ_WORD];
+    input[..SZ_G1].copy_from_slice(pt);
+    input[SZ_G1..].copy_from_slice(sc);
+    let eip_result = EIP196Executor::mul(&input).map_err(to_py_err)?;
+    let mut output = [0u8; SZ_G1];
+    output.copy_from_slice(&eip_result[..SZ_G1]);
+    Ok(output)
+}
+
+// sum of n packed G1 points
+#[pyfunction]
+fn curve_add_many(py: Python<'_>, pts: &[u8]) -> PyResult<PyObject> {
+    let n = check_len(pts.len(), SZ_G1)?;
+    let acc = py.allow_threads(|| -> PyResult<[u8; SZ_G1]> {
+        let mut acc = [0u8; SZ_G1];
+        for i in 0..n {
+            acc = g1_add(&acc, &pts[i*SZ_G1..(i+1)*SZ_G1])?;
+        }
+        Ok(acc)
+    })?;
+    Ok(PyBytes::new(py, &acc).into())
+}
+
+// element-wise sc_i * pt_i for n packed G1 points and n packed scalars
+#[pyfunction]
+fn curve_mul_many(py: Python<'_>, pts: &[u8], scs: &[u8]) -> PyResult<PyObject> {
+    let n = check_len(pts.len(), SZ_G1)?;
+    if check_len(scs.len(), SZ_WORD)? != n {
+        return Err(PyValueError::new_err("number of points and scalars differ"));
+    }
+    let output = py.allow_threads(|| -> PyResult<Vec<u8>> {
+        let mut output = vec![0u8; n*SZ_G1];
+        for i in 0..n {
+            let c = g1_mul(&pts[i*SZ_G1..(i+1)*SZ_G1], &scs[i*SZ_WORD..(i+1)*SZ_WORD])?;
+            output[i*SZ_G1..(i+1)*SZ_G1].copy_from_slice(&c);
+        }
+        Ok(output)
+    })?;
+    Ok(PyBytes::new(py, &output).into())
+}
+
+// product of n pairings e(g1_i, g2_i) == 1 with a single final exponentiation
+#[pyfunction]
+fn pairing_n(py: Python<'_>, pts: &[u8]) -> PyResult<bool> {
+    if check_len(pts.len(), SZ_PAIR)? == 0 {
+        // every pair was at infinity, the empty product is 1
+        return Ok(true);
+    }
+    let eip_result = py.allow_threads(|| EIP196Executor::pair(pts)).map_err(to_py_err)?;
+    Ok(eip_result[SZ_WORD-1] != 0)
+}
 
 #[cfg(test)]
 mod tests {
@@ -126,6 +214,9 @@ fn eth_pairing_py(_py: Python<'_>, m: &PyModule) -> PyResult<()> {
     m.add_wrapped(wrap_pyfunction!(curve_add))?;
     m.add_wrapped(wrap_pyfunction!(curve_mul))?;
     m.add_wrapped(wrap_pyfunction!(pairing2))?;
+    m.add_wrapped(wrap_pyfunction!(curve_add_many))?;
+    m.add_wrapped(wrap_pyfunction!(curve_mul_many))?;
+    m.add_wrapped(wrap_pyfunction!(pairing_n))?;
 
     Ok(())
 }
@@ -0,0 +1,243 @@
+import mmap
+import struct
+from ec import ECPoint, FQ
+from py_ecc.bn128 import FQ2
+from compression import compress_g1, compress_g2, decompress_g1, decompress_g2
+
+# Binary container for scalars and G1/G2 points, readable through a memory map.
+#
+#   header:   magic 'BMTS' | version u8 | flags u8 | reserved u16 | num_sections u32 | reserved u32
+#   sections: MAX_SECTIONS x (name 16B | fields 8B | count u64 | offset u64)
+#   data:     per section, count fixed-size records laid out back to back
+#
+# A record is the concatenation of its fields, each a run of 32-byte big-endian words:
+# SCALAR = n, G1 = x | y, G2 = x.c0 | x.c1 | y.c0 | y.c1 (the order of the JSON fixtures).
+# The point at infinity is all zeros. With the COMPRESSED flag points are stored as in
+# compression.py instead: G1 = x | flags (32 bytes), G2 = x.c0 | x.c1 with flags (64 bytes).
+MAGIC = b'BMTS'
+VERSION = 1
+MAX_SECTIONS = 16
+WORD_SIZE = 32
+
+SCALAR = 's'
+G1 = '1'
+G2 = '2'
+FIELD_SIZES = {SCALAR: WORD_SIZE, G1: 2*WORD_SIZE, G2: 4*WORD_SIZE}
+COMPRESSED_FIELD_SIZES = {SCALAR: WORD_SIZE, G1: WORD_SIZE, G2: 2*WORD_SIZE}
+
+# header flags
+COMPRESSED = 0x01
+
+_header = struct.Struct('>4sBBHII')
+_section = struct.Struct('>16s8sQQ')
+HEADER_SIZE = _header.size + MAX_SECTIONS * _section.size
+
+class TokenStoreError(Exception):
+    pass
+
+def field_size(field: str, compressed=False) -> int:
+    return (COMPRESSED_FIELD_SIZES if compressed else FIELD_SIZES)[field]
+
+def record_size(fields: str, compressed=False) -> int:
+    return sum(field_size(field, compressed) for field in fields)
+
+def _int(x) -> int:
+    if isinstance(x, int):
+        return x
+    return int(x.n) if hasattr(x, 'n') else int(x)
+
+def _affine(p):
+    if isinstance(p, ECPoint):
+        p = p.normalize().p
+    return p
+
+def encode_field(field: str, x, compressed=False) -> bytes:
+    if field == SCALAR:
+        return _int(x).to_bytes(WORD_SIZE, 'big')
+    p = _affine(x)
+    if compressed and field in (G1, G2):
+        return compress_g1(p) if field == G1 else compress_g2(p)
+    if field == G1:
+        return b''.join(_int(c).to_bytes(WORD_SIZE, 'big') for c in p)
+    if field == G2:
+        if p is None:
+            return bytes(4*WORD_SIZE)
+        return b''.join(int(c).to_bytes(WORD_SIZE, 'big') for coord in p for c in coord.coeffs)
+    raise TokenStoreError(f'Unknown field kind {field!r}')
+
+def decode_field(field: str, b, ec_point=None, fq=None, compressed=False):
+    if compressed and field in (G1, G2):
+        p = decompress_g1(b) if field == G1 else decompress_g2(b)
+        return ec_point(p) if ec_point is not None else p
+    words = [int.from_bytes(b[i:i+WORD_SIZE], 'big') for i in range(0, len(b), WORD_SIZE)]
+    if field == SCALAR:
+        return fq(words[0]) if fq is not None else words[0]
+    if field == G1:
+        p = (words[0], words[1])
+    elif field == G2:
+        p = None if not any(words) else (FQ2(words[0:2]), FQ2(words[2:4]))
+    else:
+        raise TokenStoreError(f'Unknown field kind {field!r}')
+    return ec_point(p) if ec_point is not None else p
+
+class TokenStoreWriter:
+    # sections are written one after the other, so records of the open section can be streamed
+    def __init__(self, path, flags=0):
+        self.f = open(path, 'wb')
+        self.flags = flags
+        self.compressed = bool(flags & COMPRESSED)
+        self.sections = []
+        self.fields = None
+        self.f.write(bytes(HEADER_SIZE))
+
+    def section(self, name: str, fields: str):
+        if len(self.sections) == MAX_SECTIONS:
+            raise TokenStoreError(f'At most {MAX_SECTIONS} sections')
+        if any(field not in FIELD_SIZES for field in fields) or len(fields) > 8:
+            raise TokenStoreError(f'Invalid fields {fields!r}')
+        self.sections.append([name, fields, 0, self.f.tell()])
+        self.fields = fields
+        return self
+
+    def append(self, *record):
+        assert self.fields is not None and len(record) == len(self.fields)
+        self.f.write(b''.join(encode_field(field, x, self.compressed) for (field, x) in zip(self.fields, record)))
+        self.sections[-1][2] += 1
+
+    def append_raw(self, b: bytes, count: int):
+        # count records already encoded with encode_field, e.g. by a worker process
+        assert self.fields is not None and len(b) == count * record_size(self.fields, self.compressed)
+        self.f.write(b)
+        self.sections[-1][2] += count
+
+    def extend(self, records):
+        for record in records:
+            self.append(*record)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(_header.pack(MAGIC, VERSION, self.flags, 0, len(self.sections), 0))
+        for (name, fields, count, offset) in self.sections:
+            self.f.write(_section.pack(name.encode(), fields.encode(), count, offset))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Section:
+    def __init__(self, store, name, fields, count, offset):
+        self.store = store
+        self.name = name
+        self.fields = fields
+        self.count = count
+        self.offset = offset
+        self.compressed = store.compressed
+        self.record_size = record_size(fields, self.compressed)
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, i) -> memoryview:
+        # zero-copy view of the i-th record
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start = self.offset + i * self.record_size
+        return self.store.view[start:start + self.record_size]
+
+    def __getitem__(self, i):
+        b = self.raw(i)
+        record = []
+        pos = 0
+        for field in self.fields:
+            size = field_size(field, self.compressed)
+            record.append(decode_field(field, b[pos:pos + size], self.store.ec_point, self.store.fq, self.compressed))
+            pos += size
+        return tuple(record) if len(record) > 1 else record[0]
+
+    def __iter__(self):
+        return (self[i] for i in range(self.count))
+
+class TokenStore:
+    def __init__(self, path, ec_point: ECPoint = None, fq: FQ = None):
+        self.ec_point = ec_point
+        self.fq = fq
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+
+        (magic, version, self.flags, _, num_sections, _) = _header.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise TokenStoreError(f'Not a version {VERSION} token store: {path}')
+        self.compressed = bool(self.flags & COMPRESSED)
+
+        self.sections = {}
+        for i in range(num_sections):
+            (name, fields, count, offset) = _section.unpack_from(self.mm, _header.size + i * _section.size)
+            name = name.rstrip(b'\0').decode()
+            section = Section(self, name, fields.rstrip(b'\0').decode(), count, offset)
+            if offset + count * section.record_size > len(self.mm):
+                raise TokenStoreError(f'Section {name!r} is truncated')
+            self.sections[name] = section
+
+    def __getitem__(self, name) -> Section:
+        return self.sections[name]
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def close(self):
+        self.view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+import os
+import unittest
+import tempfile
+from ec import from_ecc_py
+from py_ecc import bn128
+
+class TestTokenStore(unittest.TestCase):
+    def test(self):
+        BN128FQ, BN128Point = from_ecc_py('BN128', bn128)
+        ks = [BN128FQ(k) for k in [1, 2, 3]]
+        apk = BN128Point(bn128.multiply(bn128.G2, 5))
+        tokens = [(k, BN128Point(bn128.multiply(bn128.G1, k.n))) for k in ks]
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'tokens.bin')
+            with TokenStoreWriter(path) as w:
+                w.section('apk', G2).append(apk)
+                w.section('tokens', SCALAR + G1).extend(tokens)
+
+            with TokenStore(path, BN128Point, BN128FQ) as store:
+                self.assertEqual(store['apk'][0], apk)
+                self.assertEqual(len(store['tokens']), len(tokens))
+                for ((k, p), (k_, p_)) in zip(tokens, store['tokens']):
+                    self.assertEqual(k, k_)
+                    self.assertEqual(p.p, tuple(map(bn128.FQ, p_.p)))
+                self.assertEqual(bytes(store['tokens'].raw(1)[:WORD_SIZE]), (2).to_bytes(WORD_SIZE, 'big'))
+
+    def test_compressed(self):
+        BN128FQ, BN128Point = from_ecc_py('BN128', bn128)
+        apk = BN128Point(bn128.multiply(bn128.G2, 5))
+        tokens = [(BN128FQ(k), BN128Point(bn128.multiply(bn128.G1, k))) for k in [1, 2, 3]]
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'tokens.bin')
+            with TokenStoreWriter(path, flags=COMPRESSED) as w:
+                w.section('apk', G2).append(apk)
+                w.section('tokens', SCALAR + G1).extend(tokens)
+            self.assertEqual(os.path.getsize(path), HEADER_SIZE + 2*WORD_SIZE + 3 * 2*WORD_SIZE)
+
+            with TokenStore(path) as store:
+                self.assertTrue(store.compressed)
+                self.assertEqual(store['apk'][0], apk.p)
+                for ((k, p), (k_, p_)) in zip(tokens, store['tokens']):
+                    self.assertEqual(k.n, k_)
+                    self.assertEqual(tuple(map(bn128.FQ, p_)), p.p)
@@ -1,3 +1,7 @@
+import asyncio
+import threading
+from functools import wraps
+from collections import OrderedDict, defaultdict
 from ec import ECPoint, FQ
 from py_ecc.fields.field_elements import FQ2
 from py_ecc.fields.optimized_field_elements import FQ as optimized_FQ, FQ2 as optimized_FQ2
@@ -10,38 +14,194 @@ MAX_INT_SIZE = 32 # bytes
 class SerializationError(Exception):
     pass
 
-def serialize(*args) -> bytes:
-    b = b""
-    for i in range(len(args)):
-        assert args[i] is not None
-        if type(args[i]) is int:
-            b += args[i].to_bytes(MAX_INT_SIZE, 'big')
-        elif issubclass(type(args[i]), FQ) or issubclass(type(args[i]), optimized_FQ):
-            b += serialize(args[i].n)
-        elif issubclass(type(args[i]), ECPoint):
-            y = args[i].normalize().p if len(args[i].p) == 3 else args[i].p
-            b += serialize(*y)
-        elif issubclass(type(args[i]), FQ2) or issubclass(type(args[i]), optimized_FQ2):
-            b += serialize(*args[i].coeffs)
-        elif type(args[i]) is str:
-            b += args[i].encode('utf-8')
-        elif type(args[i]) is bytes:
-            b += args[i]
-        elif issubclass(type(args[i]), py_ecc_FQ): # TODO: remove
-            b += serialize(args[i].n)
-        elif type(args[i]) is tuple:
-            if len(args[i]) == 3 and all(map(lambda x: isinstance(x, optimized_bn128_FQ), args[i])):
-                b += serialize(*normalize(args[i]))
-            else:
-                b += serialize(*args[i])
-        elif type(args[i]) is list:
-            b += serialize(*args[i])
+# exact type -> writer(out: bytearray, x), subclasses are resolved through _base_serializers once
+_serializers = {}
+_base_serializers = []
+
+def register_serializer(cls, writer, subclasses=False):
+    if subclasses:
+        _base_serializers.append((cls, writer))
+    else:
+        _serializers[cls] = writer
+
+def _serializer_for(cls):
+    writer = _serializers.get(cls)
+    if writer is None:
+        for (base, base_writer) in _base_serializers:
+            if issubclass(cls, base):
+                writer = base_writer
+                break
+        else:
+            raise SerializationError(f'Cannot serialize argument of type {cls}')
+        _serializers[cls] = writer
+    return writer
+
+def _write(out: bytearray, x):
+    assert x is not None
+    _serializer_for(type(x))(out, x)
+
+def _write_all(out: bytearray, xs):
+    for x in xs:
+        _write(out, x)
+
+def _write_int(out: bytearray, x: int):
+    out += x.to_bytes(MAX_INT_SIZE, 'big')
+
+def _write_ec_point(out: bytearray, x: ECPoint):
+    _write_all(out, x.normalize().p if len(x.p) == 3 else x.p)
+
+def _write_tuple(out: bytearray, x: tuple):
+    if len(x) == 3 and all(map(lambda c: isinstance(c, optimized_bn128_FQ), x)):
+        x = normalize(x)
+    _write_all(out, x)
+
+register_serializer(int, _write_int)
+register_serializer(str, lambda out, x: out.extend(x.encode('utf-8')))
+register_serializer(bytes, bytearray.extend)
+register_serializer(bytearray, bytearray.extend)
+register_serializer(memoryview, bytearray.extend)
+register_serializer(tuple, _write_tuple)
+register_serializer(list, _write_all)
+register_serializer(FQ, lambda out, x: _write_int(out, x.n), subclasses=True)
+register_serializer(optimized_FQ, lambda out, x: _write_int(out, x.n), subclasses=True)
+register_serializer(ECPoint, _write_ec_point, subclasses=True)
+register_serializer(FQ2, lambda out, x: _write_all(out, x.coeffs), subclasses=True)
+register_serializer(optimized_FQ2, lambda out, x: _write_all(out, x.coeffs), subclasses=True)
+register_serializer(py_ecc_FQ, lambda out, x: _write_int(out, x.n), subclasses=True) # TODO: remove
+
+# encoded_size(*args) == len(serialize(*args)) without building the bytes; compressed=True sizes
+# points as x plus a sign bit (one coordinate) instead of the full affine (x, y)
+_sizers = {}
+_base_sizers = []
+
+def register_encoded_size(cls, sizer, subclasses=False):
+    # sizer(x, compressed) -> int, alongside the writer registered with register_serializer
+    if subclasses:
+        _base_sizers.append((cls, sizer))
+    else:
+        _sizers[cls] = sizer
+
+def _sizer_for(cls):
+    sizer = _sizers.get(cls)
+    if sizer is None:
+        for (base, base_sizer) in _base_sizers:
+            if issubclass(cls, base):
+                sizer = base_sizer
+                break
         else:
-            #import inspect
-            #print(inspect.getmro(args[i].__class__))
-            raise SerializationError(f'Cannot serialize argument of type {type(args[i])}')
+            raise SerializationError(f'Cannot size argument of type {cls}')
+        _sizers[cls] = sizer
+    return sizer
+
+def _size(x, compressed=False) -> int:
+    assert x is not None
+    return _sizer_for(type(x))(x, compressed)
+
+def _size_all(xs, compressed=False) -> int:
+    return sum(_size(x, compressed) for x in xs)
+
+def _size_ec_point(x: ECPoint, compressed=False) -> int:
+    # affine and Jacobian points are both written as (x, y)
+    coordinate = _size(x.p[0])
+    return coordinate if compressed else 2 * coordinate
+
+def _size_tuple(x: tuple, compressed=False) -> int:
+    if len(x) == 3 and all(map(lambda c: isinstance(c, optimized_bn128_FQ), x)):
+        x = x[:2]
+    return _size_all(x, compressed)
+
+register_encoded_size(int, lambda x, compressed: MAX_INT_SIZE)
+register_encoded_size(str, lambda x, compressed: len(x) if x.isascii() else len(x.encode('utf-8')))
+register_encoded_size(bytes, lambda x, compressed: len(x))
+register_encoded_size(bytearray, lambda x, compressed: len(x))
+register_encoded_size(memoryview, lambda x, compressed: x.nbytes)
+register_encoded_size(tuple, _size_tuple)
+register_encoded_size(list, _size_all)
+register_encoded_size(FQ, lambda x, compressed: MAX_INT_SIZE, subclasses=True)
+register_encoded_size(optimized_FQ, lambda x, compressed: MAX_INT_SIZE, subclasses=True)
+register_encoded_size(ECPoint, _size_ec_point, subclasses=True)
+register_encoded_size(FQ2, lambda x, compressed: 2 * MAX_INT_SIZE, subclasses=True)
+register_encoded_size(optimized_FQ2, lambda x, compressed: 2 * MAX_INT_SIZE, subclasses=True)
+register_encoded_size(py_ecc_FQ, lambda x, compressed: MAX_INT_SIZE, subclasses=True) # TODO: remove
+
+def encoded_size(*args, compressed=False) -> int:
+    return _size_all(args, compressed)
+
+def serialize(*args) -> bytes:
+    # the result can be passed back in place of its arguments, e.g. to encode a fixed
+    # committee key list once and reuse it as a prefix: serialize(serialize(pks), pk) == serialize(pks, pk)
+    out = bytearray()
+    _write_all(out, args)
+    return bytes(out)
+
+class Transcript:
+    # incremental hash over serialize()d arguments; digest(*suffix) leaves the absorbed state untouched
+    # so a shared prefix is hashed once and finalized with many short suffixes
+    def __init__(self, hash_ctor, *args):
+        self.state = hash_ctor()
+        self.absorb(*args)
+
+    def absorb(self, *args):
+        self.state.update(serialize(*args))
+        return self
+
+    def copy(self):
+        t = Transcript.__new__(Transcript)
+        t.state = self.state.copy()
+        return t
+
+    def digest(self, *args) -> bytes:
+        return self.copy().absorb(*args).state.digest()
+
+class BufferedHash:
+    # hashlib-style wrapper around a one-shot digest function (bytes -> bytes)
+    def __init__(self, hash, data=b''):
+        self.hash = hash
+        self.data = bytearray(data)
+
+    @classmethod
+    def ctor(cls, hash):
+        return lambda: cls(hash)
 
-    return b
+    def update(self, data):
+        self.data += data
+
+    def copy(self):
+        return BufferedHash(self.hash, self.data)
+
+    def digest(self):
+        return self.hash(bytes(self.data))
+
+class LRUCache:
+    # shared by the signer threads of an executor, so every access holds the lock: even a lookup
+    # reorders the entries
+    def __init__(self, maxsize):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
 
 def int_tuple_to_point(i, j):
     return (i << MAX_INT_SIZE*8) | j
@@ -52,19 +212,65 @@ def initialize_2d_array(rows, columns):
 def initialize_2d_arrays(rows, columns, count):
     return [initialize_2d_array(rows, columns) for _ in range(count)]
 
-def multi_controller(P0, Ps):
+def broadcast(Ps, msgs, executor=None):
+    # one protocol round: msgs[i] goes to Ps[i], replies are gathered in order
+    assert len(Ps) == len(msgs)
+    if executor is None:
+        return [p.send(msg) for (p, msg) in zip(Ps, msgs)]
+    return list(executor.map(lambda p, msg: p.send(msg), Ps, msgs))
+
+def multi_controller(P0, Ps, executor=None):
+    # P0 yields a list with one message per party in Ps for each round and is sent back the
+    # list of replies; its return value is the result of the session
     Pgs = [P() for P in Ps]
-    for p in Pgs:
-        next(p)
+    broadcast(Pgs, [None] * len(Pgs), executor)
 
-    p0 = P0(Pgs)
-    value = next(p0)
+    p0 = P0()
+    try:
+        msgs = next(p0)
+        while True:
+            msgs = p0.send(broadcast(Pgs, msgs, executor))
+    except StopIteration as e:
+        return e.value
 
-    while True:
-        try:
-            value = next(p0)
-        except StopIteration:
-            return value
+async def async_multi_controller(P0, endpoints, timeout=None):
+    # like multi_controller, but each round is fanned out concurrently to async endpoints
+    # (objects with `async def send(msg)`); a round taking longer than timeout raises TimeoutError
+    p0 = P0()
+    try:
+        msgs = next(p0)
+        while True:
+            assert len(endpoints) == len(msgs)
+            replies = await asyncio.wait_for(
+                asyncio.gather(*[e.send(msg) for (e, msg) in zip(endpoints, msgs)]),
+                timeout
+            )
+            msgs = p0.send(replies)
+    except StopIteration as e:
+        return e.value
+
+class LoopbackEndpoint:
+    # async endpoint serving an in-process party generator, optionally delaying every reply. With a
+    # codec (encode(msg) -> bytes, decode(bytes) -> msg, e.g. compression.PointCodec) both directions
+    # go through their wire encoding, whose sizes are counted in bytes_sent and bytes_received
+    def __init__(self, P, delay=0, codec=None):
+        self.p = P()
+        self.delay = delay
+        self.codec = codec
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        next(self.p)
+
+    async def send(self, msg):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.codec is None:
+            return self.p.send(msg)
+        data = self.codec.encode(msg)
+        self.bytes_sent += len(data)
+        data = self.codec.encode(self.p.send(self.codec.decode(data)))
+        self.bytes_received += len(data)
+        return self.codec.decode(data)
 
 def controller(P1, P2):
     p1 = P1()
@@ -78,41 +284,92 @@ def controller(P1, P2):
         except StopIteration:
             return value
 
-def count_bytes(data): # TODO: (data, max_int_size=32)
+def count_bytes(data, compressed=False): # TODO: (data, max_int_size=32)
     if data is None:
         return 0
-    return len(serialize(data))
+    return encoded_size(data, compressed=compressed)
+
+class ByteCounter:
+    # bytes sent and received per party and round; a party is a generator name plus the index of
+    # its instance, e.g. S[0], S[1], ... for the signers of a multi_controller session
+    def __init__(self, compressed=False):
+        self.compressed = compressed
+        self.counts = defaultdict(lambda: [0, 0]) # (name, index, round) -> [sent, received]
+        self.instances = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def party(self, name):
+        with self.lock:
+            index = self.instances[name]
+            self.instances[name] += 1
+        return (name, index)
+
+    def add(self, party, round, sent=None, received=None):
+        (name, index) = party
+        entry = self.counts[(name, index, round)]
+        entry[0] += count_bytes(sent, self.compressed)
+        entry[1] += count_bytes(received, self.compressed)
 
-def byte_count_decorator(generator_func):
+    def report(self):
+        return [
+            {'party': f'{name}[{index}]', 'round': round, 'sent': sent, 'received': received}
+            for ((name, index, round), (sent, received)) in sorted(self.counts.items())
+        ]
+
+    def totals(self):
+        totals = defaultdict(lambda: {'sent': 0, 'received': 0})
+        for row in self.report():
+            totals[row['party']]['sent'] += row['sent']
+            totals[row['party']]['received'] += row['received']
+        return dict(totals)
+
+def _count_bytes(gen, counter, party):
+    (round, value) = (0, None)
+    while True:
+        try:
+            next_value = gen.send(value)
+        except StopIteration as e:
+            return e.value
+        counter.add(party, round, sent=next_value)
+        value = yield next_value
+        counter.add(party, round, received=value)
+        round += 1
+
+def byte_count_decorator(generator_func=None, counter: ByteCounter = None, party=None, compressed=False):
+    # counts the encoded size of every message a party generator yields and is sent. With a
+    # counter the sizes are collected per party and round, e.g.
+    #   multi_controller(byte_count_decorator(lambda: bm.U(m, pks), counter, 'U'), ...)
+    # without one, each instance prints its totals when it finishes or is closed
+    if generator_func is None:
+        return lambda f: byte_count_decorator(f, counter, party, compressed)
+
+    @wraps(generator_func)
     def wrapper(*args, **kwargs):
-        byte_counts = {'sent': 0, 'received': 0}
-        gen = generator_func(*args, **kwargs)
-        value = None
-        while True:
-            try:
-                # send value to generator and get next value
-                next_value = gen.send(value)
-                byte_counts['sent'] += count_bytes(next_value)
-                # send value back to the caller
-                value = yield next_value
-                # TODO: pass max_int_size to count_bytes
-                byte_counts['received'] += count_bytes(value)
-            except GeneratorExit:
-                print(f"func: '{generator_func.__name__}' sent {byte_counts['sent']} & received {byte_counts['received']} bytes")
-                break
-            except StopIteration:
-                break
+        # the party is assigned on creation, so the instance index follows creation order even if
+        # the generators are first resumed concurrently
+        c = counter if counter is not None else ByteCounter(compressed)
+        p = c.party(party or generator_func.__name__)
+        gen = _count_bytes(generator_func(*args, **kwargs), c, p)
+        if counter is not None:
+            return gen
+        return _print_totals(gen, c, p)
     return wrapper
 
-from functools import wraps
-from time import time
-def timing_decorator(f): # TODO: rename
+def _print_totals(gen, counter, party):
+    try:
+        return (yield from gen)
+    finally:
+        totals = counter.totals().get(f'{party[0]}[{party[1]}]', {'sent': 0, 'received': 0})
+        print(f"func: '{party[0]}' sent {totals['sent']} & received {totals['received']} bytes")
+
+from time import perf_counter
+def wall_time_decorator(f):
+    # prints the wall time of each call, see instrument.Instrumentation for a per-operation breakdown
     @wraps(f)
     def wrap(*args, **kw):
-        ts = time()
+        ts = perf_counter()
         result = f(*args, **kw)
-        te = time()
-        #print('func: %r args:[%r, %r] took: %2.4f sec' % (f.__name__, args, kw, te-ts))
+        te = perf_counter()
         print('func: %r took: %2.4f sec' % (f.__name__, te - ts))
         return result
 
@@ -4,6 +4,7 @@ pragma solidity ^0.8.17;
 import "forge-std/Test.sol";
 import {BM_BLS} from "../src/BM_BLS.sol";
 import {BLS} from "../src/utils/BLS.sol";
+import {TokenStore} from "./utils/TokenStore.sol";
 
 contract BM_BLSTest is Test {
     BLS public bls;
@@ -48,6 +49,31 @@ contract BM_BLSTest is Test {
         _testVerifyAggrFixture(sf);
     }
 
+    function _readApk(bytes memory data) internal pure returns (uint256[] memory apk) {
+        TokenStore.Section memory s = TokenStore.section(data, "apk");
+        apk = new uint256[](4);
+        for (uint256 j = 0; j < 4; j++) {
+            apk[j] = TokenStore.recordWord(data, s, 0, j);
+        }
+    }
+
+    function testVerifyAggrBinary() public {
+        bytes memory data = vm.readFileBinary("py/data/input_aggr.bin");
+        TokenStore.Section memory tokens = TokenStore.section(data, "tokens");
+
+        SignatureFixture memory sf;
+        sf.apk = _readApk(data);
+        sf.messages = new uint256[](tokens.count);
+        sf.signatures = new uint256[][](tokens.count);
+        for (uint256 i = 0; i < tokens.count; i++) {
+            sf.messages[i] = TokenStore.recordWord(data, tokens, i, 0);
+            sf.signatures[i] = new uint256[](2);
+            sf.signatures[i][0] = TokenStore.recordWord(data, tokens, i, 1);
+            sf.signatures[i][1] = TokenStore.recordWord(data, tokens, i, 2);
+        }
+        _testVerifyAggrFixture(sf);
+    }
+
     function _testVerifyAggrHmFixture(SignatureHmFixture memory sf) internal {
         uint256[4] memory apk = [sf.apk[0], sf.apk[1], sf.apk[2], sf.apk[3]];
 
@@ -75,6 +101,25 @@ contract BM_BLSTest is Test {
         _testVerifyAggrHmFixture(sf);
     }
 
+    function testVerifyAggrHmBinary() public {
+        bytes memory data = vm.readFileBinary("py/data/input_aggr_hm.bin");
+        TokenStore.Section memory tokens = TokenStore.section(data, "tokens");
+
+        SignatureHmFixture memory sf;
+        sf.apk = _readApk(data);
+        sf.messageHashes = new uint256[][](tokens.count);
+        sf.signatures = new uint256[][](tokens.count);
+        for (uint256 i = 0; i < tokens.count; i++) {
+            sf.messageHashes[i] = new uint256[](2);
+            sf.messageHashes[i][0] = TokenStore.recordWord(data, tokens, i, 0);
+            sf.messageHashes[i][1] = TokenStore.recordWord(data, tokens, i, 1);
+            sf.signatures[i] = new uint256[](2);
+            sf.signatures[i][0] = TokenStore.recordWord(data, tokens, i, 2);
+            sf.signatures[i][1] = TokenStore.recordWord(data, tokens, i, 3);
+        }
+        _testVerifyAggrHmFixture(sf);
+    }
+
     function testVerify() public {
         uint256[2] memory signature = [
             12099452429872967987634519446390896416640783663211103224510701214821200133031,
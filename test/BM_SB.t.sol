@@ -4,6 +4,7 @@ pragma solidity ^0.8.17;
 import "forge-std/Test.sol";
 import {BM_SB} from "../src/BM_SB.sol";
 import {BLS} from "../src/utils/BLS.sol";
+import {TokenStore} from "./utils/TokenStore.sol";
 
 contract BM_SBTest is Test {
     BLS public bls;
@@ -45,4 +46,25 @@ contract BM_SBTest is Test {
         SignatureFixture memory sf = abi.decode(vm.parseJson(json), (SignatureFixture));
         _testVerifyFixture(sf);
     }
+
+    function testVerifyBinary() public {
+        bytes memory data = vm.readFileBinary("py/data/input.bin");
+        TokenStore.Section memory pks = TokenStore.section(data, "pks");
+        TokenStore.Section memory tokens = TokenStore.section(data, "tokens");
+
+        SignatureFixture memory sf;
+        sf.pks = new uint256[][](pks.count);
+        for (uint256 i = 0; i < pks.count; i++) {
+            sf.pks[i] = new uint256[](2);
+            sf.pks[i][0] = TokenStore.recordWord(data, pks, i, 0);
+            sf.pks[i][1] = TokenStore.recordWord(data, pks, i, 1);
+        }
+        sf.m = TokenStore.recordWord(data, tokens, 0, 0);
+        sf.R_bar = new uint256[](2);
+        sf.R_bar[0] = TokenStore.recordWord(data, tokens, 0, 1);
+        sf.R_bar[1] = TokenStore.recordWord(data, tokens, 0, 2);
+        sf.y_bar = TokenStore.recordWord(data, tokens, 0, 3);
+        sf.z_bar = TokenStore.recordWord(data, tokens, 0, 4);
+        _testVerifyFixture(sf);
+    }
 }
@@ -0,0 +1,66 @@
+// SPDX-License-Identifier: UNLICENSED
+pragma solidity ^0.8.17;
+
+// Reader for the binary fixtures written by py/token_store.py (see the layout there).
+library TokenStore {
+    bytes4 internal constant MAGIC = "BMTS";
+    uint256 internal constant HEADER_SIZE = 16;
+    uint256 internal constant SECTION_SIZE = 40;
+    uint256 internal constant WORD_SIZE = 32;
+
+    struct Section {
+        uint256 recordSize;
+        uint256 count;
+        uint256 offset;
+    }
+
+    function word(bytes memory data, uint256 offset) internal pure returns (uint256 w) {
+        require(offset + WORD_SIZE <= data.length, "TokenStore: out of bounds");
+        assembly {
+            w := mload(add(add(data, 32), offset))
+        }
+    }
+
+    function _recordSize(bytes8 fields) private pure returns (uint256 size) {
+        for (uint256 i = 0; i < 8; i++) {
+            bytes1 field = fields[i];
+            if (field == "s") {
+                size += WORD_SIZE;
+            } else if (field == "1") {
+                size += 2 * WORD_SIZE;
+            } else if (field == "2") {
+                size += 4 * WORD_SIZE;
+            } else {
+                require(field == bytes1(0), "TokenStore: unknown field");
+            }
+        }
+    }
+
+    function section(bytes memory data, bytes16 name) internal pure returns (Section memory s) {
+        uint256 header = word(data, 0);
+        require(bytes4(bytes32(header)) == MAGIC, "TokenStore: bad magic");
+        require(uint8(header >> 216) == 1, "TokenStore: unsupported version");
+        require(uint8(header >> 208) == 0, "TokenStore: compressed stores are not supported");
+
+        uint256 numSections = uint32(header >> 160);
+        for (uint256 i = 0; i < numSections; i++) {
+            uint256 base = HEADER_SIZE + i * SECTION_SIZE;
+            uint256 w = word(data, base);
+            if (bytes16(bytes32(w)) != name) {
+                continue;
+            }
+            s.recordSize = _recordSize(bytes8(bytes32(w << 128)));
+            s.count = uint64(w);
+            s.offset = word(data, base + WORD_SIZE) >> 192;
+            require(s.offset + s.count * s.recordSize <= data.length, "TokenStore: truncated section");
+            return s;
+        }
+        revert("TokenStore: missing section");
+    }
+
+    // j-th 32-byte word of the i-th record
+    function recordWord(bytes memory data, Section memory s, uint256 i, uint256 j) internal pure returns (uint256) {
+        require(i < s.count && (j + 1) * WORD_SIZE <= s.recordSize, "TokenStore: out of bounds");
+        return word(data, s.offset + i * s.recordSize + j * WORD_SIZE);
+    }
+}